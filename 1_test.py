@@ -27,6 +27,7 @@ import numpy as np
 import os
 from datetime import datetime
 from camera_manager import *
+from stereo_recorder import StereoRecorder
 
 # initialising camera manager
 man = CameraManager()
@@ -42,12 +43,21 @@ counter = 0
 # Capture frames from the camera to path
 folder_to_capture = './test_pairs/'
 i = 1
+# folder for recorded sessions ('r' starts and stops recording), recorder gets every captured pair
+# from capture threads, so recording isn't limited by the display loop and lost pairs are counted as dropped
+sessions_folder = './sessions/'
+recorder = None
 try:
     while True:
         counter += 1
         if (os.path.isdir("./scenes") == False):
             os.makedirs("./scenes")
-        frame_left, frame_right = man.get_stereo()
+        pair = man.get_stereo_pair()
+        if pair is None:
+            if not man.running:
+                break
+            continue
+        frame_left, frame_right = pair.left, pair.right
         # creating and showing stereopair
         double_img = np.concatenate((frame_left, frame_right), axis=1)
         cv2.imshow('stereoimage', double_img)
@@ -63,7 +73,19 @@ try:
             cv2.imwrite(folder_to_capture + str(i).rjust(2, '0') + 'L.png', frame_left)
             cv2.imwrite(folder_to_capture + str(i).rjust(2, '0') + 'R.png', frame_right)
             i += 1
+        # if 'r' pressed, starting or stopping session recording
+        if key == ord('r'):
+            if recorder is None:
+                recorder = StereoRecorder(sessions_folder + datetime.now().strftime('%Y%m%d_%H%M%S'))
+                man.add_listener(recorder.add_pair)
+                print('recording started')
+            else:
+                man.remove_listener(recorder.add_pair)
+                recorder.stop()
+                recorder = None
 finally:
     # it's strongly recommended to use try-finally syntax to stop camera threads correctly
     man.stop()
+    if recorder is not None:
+        recorder.stop()
     print('stopped')
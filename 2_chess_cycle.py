@@ -26,6 +26,7 @@ import os
 import time
 from datetime import datetime
 from camera_manager import *
+from stereo_recorder import StereoRecorder
 
 print("You can press 'Q' to quit this script.")
 
@@ -47,6 +48,8 @@ print('capturing to path:', path)
 # initializing camera manager and waiting 1 secs for threads to start
 man = CameraManager()
 sleep(1)
+# pairs are written by recorder thread, so display loop isn't blocked by imwrite
+recorder = StereoRecorder(path, images=True)
 # Lets start taking photos! 
 counter = 0
 t2 = datetime.now()
@@ -63,10 +66,7 @@ try:
             counter += 1
             leftName = path + 'left_' + str(counter).zfill(2) + '.png'
             rightName = path + 'right_' + str(counter).zfill(2) + '.png'
-            if write_left:
-                cv2.imwrite(leftName, imgLeft)
-            if write_right:
-                cv2.imwrite(rightName, imgRight)
+            recorder.add(imgLeft if write_left else None, imgRight if write_right else None)
             print(' [' + str(counter) + ' of ' + str(total_photos) + '] ' + leftName, rightName)
             i = 0
         # constantly showing last received images
@@ -84,6 +84,7 @@ try:
 finally:
     # it's strongly recommended to use try-finally syntax to stop camera threads correctly
     man.stop()
+    recorder.stop()
     running = False
     sleep(1)
     print('threads stopped')
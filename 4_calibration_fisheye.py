@@ -373,9 +373,12 @@ def calibrate_stereo_cameras(res_x=img_width, res_y=img_height):
         rightCameraMatrix, rightDistortionCoefficients, rightRectification,
         rightProjection, imageSize, cv2.CV_16SC2)
 
+    # object points are given in chessboard squares, so depth from dispartityToDepthMap is in squares too
+    # (depthUnit is the size of square in metres)
     np.savez_compressed('./calibration_data/{}p/stereo_camera_calibration.npz'.format(res_y), imageSize=imageSize,
                         leftMapX=leftMapX, leftMapY=leftMapY,
-                        rightMapX=rightMapX, rightMapY=rightMapY, dispartityToDepthMap=dispartityToDepthMap)
+                        rightMapX=rightMapX, rightMapY=rightMapY, dispartityToDepthMap=dispartityToDepthMap,
+                        depthUnit=square_size / 100)
     return True
 
 
@@ -31,6 +31,7 @@ import numpy as np
 import json
 import time
 from camera_manager import *
+from calibration_store import load_calibration
 
 # Global variables preset
 imageToDisp = './scenes/01'
@@ -66,7 +67,7 @@ imgRight = cv2.cvtColor(imgRight, cv2.COLOR_BGR2GRAY)
 print('Read calibration data and rectifying stereo pair...')
 
 try:
-    npzfile = np.load('./calibration_data/{}p/stereo_camera_calibration.npz'.format(photo_height))
+    npzfile = load_calibration('./calibration_data/{}p/stereo_camera_calibration.npz'.format(photo_height))
 except:
     print(
         "Camera calibration data not found in cache, file " + './calibration_data/{}p/stereo_camera_calibration.npz'.format(
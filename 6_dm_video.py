@@ -26,8 +26,12 @@ import time
 import cv2
 import numpy as np
 import json
-from datetime import datetime
 from camera_manager import *
+from replay_source import open_replay
+from rectifier import Rectifier
+from calibration_store import load_calibration
+from matchers import make_matcher
+from latency_stats import LatencyStats, mark
 
 print("You can press Q to quit this script!")
 time.sleep(2)
@@ -44,6 +48,15 @@ SR = 14
 SPWS = 100
 
 useStripe = False
+# disparity backend: 'bm', 'bm_tiled' (horizontal bands in parallel threads), 'bm_half' (half resolution),
+# 'sgbm_3way', 'sgbm', 'sgbm_half' (run matchers.py to compare their latency and quality on stored pairs)
+matcherName = 'bm'
+# folder with stored pairs (like './demo/') or (left, right) video files to run without cameras
+replaySource = None
+# replay with camera fps or as fast as possible (for measuring max throughput)
+replayRealtime = True
+# latencies from capture to shown disparity are dumped at exit to latencyDump + '.json' and '.csv'
+latencyDump = None
 dm_colors_autotune = True
 disp_max = -100000
 disp_min = 10000
@@ -62,7 +75,10 @@ img_width = 640
 img_height = 480
 print("Scaled image resolution: " + str(img_width) + " x " + str(img_height))
 
-man = CameraManager()
+if replaySource is None:
+    man = CameraManager(synchronized=True, gray=True)
+else:
+    man = open_replay(replaySource, realtime=replayRealtime, gray=True)
 
 # Initialize interface windows
 cv2.namedWindow("Image")
@@ -73,7 +89,7 @@ cv2.namedWindow("right")
 cv2.moveWindow("right", 850, 100)
 
 disparity = np.zeros((img_width, img_height), np.uint8)
-sbm = cv2.StereoBM_create(numDisparities=0, blockSize=21)
+matcher = make_matcher(matcherName)
 
 
 def stereo_depth_map(rectified_pair):
@@ -81,7 +97,7 @@ def stereo_depth_map(rectified_pair):
     global disp_min
     dmLeft = rectified_pair[0].astype('uint8')
     dmRight = rectified_pair[1].astype('uint8')
-    disparity = sbm.compute(dmLeft, dmRight)
+    disparity = matcher.compute(dmLeft, dmRight)
     local_max = disparity.max()
     local_min = disparity.min()
     if (dm_colors_autotune):
@@ -115,51 +131,51 @@ def load_map_settings(fName):
     UR = data['uniquenessRatio']
     SR = data['speckleRange']
     SPWS = data['speckleWindowSize']
-    # sbm.setSADWindowSize(SWS)
-    sbm.setPreFilterType(1)
-    sbm.setPreFilterSize(PFS)
-    sbm.setPreFilterCap(PFC)
-    sbm.setMinDisparity(MDS)
-    sbm.setNumDisparities(NOD)
-    sbm.setTextureThreshold(TTH)
-    sbm.setUniquenessRatio(UR)
-    sbm.setSpeckleRange(SR)
-    sbm.setSpeckleWindowSize(SPWS)
+    matcher.configure(data)
     f.close()
     print('Parameters loaded from file ' + fName)
 
 
 load_map_settings("3dmap_set.txt")
 try:
-    npzfile = np.load('./calibration_data/{}p/stereo_camera_calibration.npz'.format(img_height))
+    npzfile = load_calibration('./calibration_data/{}p/stereo_camera_calibration.npz'.format(img_height))
 except:
     print("Camera calibration data not found in cache, file ",
           './calibration_data/{}p/stereo_camera_calibration.npz'.format(img_height))
     exit(0)
 
 imageSize = tuple(npzfile['imageSize'])
-leftMapX = npzfile['leftMapX']
-leftMapY = npzfile['leftMapY']
-rightMapX = npzfile['rightMapX']
-rightMapY = npzfile['rightMapY']
-
+# rectification maps are cropped to the strip from settings file (lidar-like mode saving CPU),
+# so only the pixels used by the matcher are remapped
+if useStripe:
+    # the top half of images without 100 px at the sides (own file, strip_set.txt is the band of 7_2d_map.py)
+    rectifier = Rectifier(npzfile, "video_strip_set.txt")
+else:
+    rectifier = Rectifier(npzfile)
+
+# sequence number of the last processed pair
+last_seq = 0
+latency_stats = LatencyStats()
 try:
     while 1:
-        t1 = datetime.now()
-        imgLeft, imgRight = man.get_stereo()
-        imgLeft = cv2.cvtColor(imgLeft, cv2.COLOR_BGR2GRAY)
-        imgRight = cv2.cvtColor(imgRight, cv2.COLOR_BGR2GRAY)
-        imgL = cv2.remap(imgLeft, leftMapX, leftMapY, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
-        imgR = cv2.remap(imgRight, rightMapX, rightMapY, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
-
-        if (useStripe):
-            imgRcut = imgR[:img_height // 2, 100:img_width - 100]
-            imgLcut = imgL[:img_height // 2, 100:img_width - 100]
-        else:
-            imgRcut = imgR
-            imgLcut = imgL
+        # waiting for a new pair instead of processing the same frames again
+        lease = man.lease_pair(last_seq, timeout=1.)
+        if lease is None:
+            if not man.running:
+                # cameras are lost or replay is finished
+                break
+            continue
+        last_seq = lease.seq
+        frame = {'marks': [('capture', lease.timestamp)]}
+        mark(frame, 'camera')
+        # frames are already grayscale (camera gray mode), they are rectified into preallocated buffers
+        # and given back to the camera pool right away
+        with lease:
+            imgLcut, imgRcut = rectifier.rectify(lease.left, lease.right)
         rectified_pair = (imgLcut, imgRcut)
+        mark(frame, 'rectify')
         disparity = stereo_depth_map(rectified_pair)
+        mark(frame, 'disparity')
         # show the frame
         cv2.imshow("left", imgLcut)
         cv2.imshow("right", imgRcut)
@@ -169,10 +185,16 @@ try:
         if key == ord("q"):
             break
 
-        t2 = datetime.now()
-        print("DM build time: " + str(t2 - t1))
+        mark(frame, 'display')
+        # time from capture of the pair, not only from the start of processing
+        print("DM build time: {:.1f} ms".format(latency_stats.add_marks(frame['marks']) * 1000))
 
 finally:
+    latency_stats.print_stats()
+    if latencyDump is not None:
+        latency_stats.dump(latencyDump)
+    print('Camera counters:', man.get_counters())
+    matcher.stop()
     # it's strongly recommended to use try-finally syntax to stop camera threads correctly
     man.stop()
     sleep(2)
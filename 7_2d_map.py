@@ -26,8 +26,22 @@ import time
 import cv2
 import numpy as np
 import json
-from datetime import datetime
 from camera_manager import *
+from replay_source import open_replay
+from rectifier import Rectifier
+from calibration_store import load_calibration
+from pipeline import Pipeline
+from matchers import make_matcher
+from coarse_to_fine import CoarseToFineMatcher
+from incremental_matcher import IncrementalMatcher
+from latency_governor import LatencyGovernor, QualityLevel
+from disparity_workers import DisparityPool, column_values, sector_maxima
+from column_stats import ColumnStatistics
+from depth_table import DepthTable
+from occupancy_grid import OccupancyGrid
+from ground_plane import GroundPlane
+from latency_stats import LatencyStats, mark, timed_stage
+from actuation_recorder import ActuationRecorder, analyze, print_report
 from motor_manager import *
 
 print("You can press 'Q' to quit this script!")
@@ -37,8 +51,62 @@ time.sleep(2)
 showDisparity = True
 showUndistortedImages = False
 showColorizedDistanceLine = True
+showOccupancyGrid = True  # only with occupancy grid mode
 stripImage = True
 
+# Processing settings
+# every stage (capture, rectify, disparity, ground, reduction, depth, haptics) runs in own thread,
+# so remap of the next frame overlaps disparity of the current one
+usePipeline = True
+# disparity and column reduction are computed by worker processes over shared memory
+# (uses all cores, only sector values come back), visualization is not available in this mode
+useProcessPool = False
+# disparity backend: 'bm', 'bm_tiled' (horizontal bands in parallel threads), 'bm_half' (half resolution),
+# 'sgbm_3way', 'sgbm', 'sgbm_half' (run matchers.py to compare their latency and quality on stored pairs)
+matcherName = 'bm'
+# whole strip is matched at half resolution, and full resolution matching is done only for columns
+# where something is close enough to turn motors on (not used with process pool)
+coarseToFine = False
+# disparity is recomputed only for columns where rectified strip has changed since the previous frame
+# (not used with coarse to fine mode and process pool)
+incrementalDisparity = False
+# statistic of valid disparities in each column used for motors: 'mean', 'max' or 'percentile'
+columnStatistic = 'mean'
+columnPercentile = 90
+# resolution, strip height and disparity range are switched at runtime (levels in latency_governor.py)
+# to keep latency from capture to haptics under the target (not used with coarse to fine mode and process pool)
+useGovernor = False
+targetLatency = 0.15  # seconds
+governorLog = 'governor_log.jsonl'  # every level change is appended to it for offline tuning
+# valid disparity pixels are fused over time into top-down polar grid (bearing x range) and motors
+# are driven by the nearest occupied cell in each sector, so single-frame noise doesn't turn
+# motors on (not used with process pool)
+useOccupancyGrid = False
+# floor plane is fitted (and refitted only when it doesn't fit any more) and floor pixels are removed
+# before column reduction, so the strip (strip_set.txt) can be taller without floor turning motors on
+# (not used with process pool)
+removeGround = False
+
+# motors: 'gpio' (pulses switched by scheduler thread), 'pwm' (pulses generated by RPi.GPIO PWM)
+# or 'mock' (no hardware, for running on a desktop)
+motorBackend = 'gpio'
+# distances to pulse timeouts curve: 'default', 'near' or 'far' (CURVES in motor_manager.py)
+motorCurve = 'default'
+# every motor pulse edge and mode change is recorded, saved to the file and analysed at exit
+# (pulse period jitter and latency of mode changes, see actuation_recorder.py)
+recordActuation = False
+actuationLog = 'actuation_log.npz'
+
+# latencies of stages from capture to applying new motor modes (and to the first pulse in new mode)
+# are printed with pipeline stats and dumped at exit to latencyDump + '.json' and '.csv' (None - no dump)
+latencyDump = 'latency_stats'
+
+# Replay settings
+# folder with stored pairs (like './demo/') or (left, right) video files to run without cameras
+replaySource = None
+# replay with camera fps or as fast as possible (for measuring max throughput)
+replayRealtime = True
+
 # Depth map default preset
 SWS = 5
 PFS = 5
@@ -58,20 +126,15 @@ print("Image resolution: " + str(img_width) + " x " + str(img_height))
 autotune_min = 10000000
 autotune_max = -10000000
 
-# 3D points settings
-focal_length = 165.0  # taken from K matrix
-tx = 65  # taken from K matrix after calibration
-q = np.array([
-    [1, 0, 0, -img_width / 2],
-    [0, 1, 0, -img_height / 2],
-    [0, 0, 0, focal_length],
-    [0, 0, -1 / tx, 0]
-])
-
-# initializing camera manager
-man = CameraManager()
+# initializing camera manager (or replay of stored pairs)
+if replaySource is None:
+    man = CameraManager(synchronized=True, gray=True)
+else:
+    man = open_replay(replaySource, realtime=replayRealtime, gray=True)
 # initializing motor manager
-motor_man = MotorManager(*PINS)
+latency_stats = LatencyStats()
+actuation_recorder = ActuationRecorder() if recordActuation else None
+motor_man = MotorManager(*PINS, backend=motorBackend, recorder=actuation_recorder, curve=motorCurve)
 motor_man.start()
 
 # Initialize interface windows
@@ -83,21 +146,15 @@ cv2.namedWindow("right")
 cv2.moveWindow("right", 850, 100)'''
 
 disparity = np.zeros((img_width, img_height), np.uint8)
-sbm = cv2.StereoBM_create(numDisparities=0, blockSize=21)
+matcher = make_matcher(matcherName)
+if incrementalDisparity and not coarseToFine:
+    matcher = IncrementalMatcher(matcher)
 
 
 def stereo_depth_map(rectified_pair):
     dmLeft = rectified_pair[0]
     dmRight = rectified_pair[1]
-    disparity = sbm.compute(dmLeft, dmRight)
-    if (showDisparity):
-        disparity_grayscale = (disparity - autotune_min) * (65535.0 / (autotune_max - autotune_min))
-        disparity_fixtype = cv2.convertScaleAbs(disparity_grayscale, alpha=(255.0 / 65535.0))
-        disparity_color = cv2.applyColorMap(disparity_fixtype, cv2.COLORMAP_JET)
-        cv2.imshow("Image", disparity_color)
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord("q"):
-            quit()
+    disparity = matcher.compute(dmLeft, dmRight)
     return disparity
 
 
@@ -115,16 +172,7 @@ def load_map_settings(fName):
     UR = data['uniquenessRatio']
     SR = data['speckleRange']
     SPWS = data['speckleWindowSize']
-    # sbm.setSADWindowSize(SWS)
-    sbm.setPreFilterType(1)
-    sbm.setPreFilterSize(PFS)
-    sbm.setPreFilterCap(PFC)
-    sbm.setMinDisparity(MDS)
-    sbm.setNumDisparities(NOD)
-    sbm.setTextureThreshold(TTH)
-    sbm.setUniquenessRatio(UR)
-    sbm.setSpeckleRange(SR)
-    sbm.setSpeckleWindowSize(SPWS)
+    matcher.configure(data)
     f.close()
     print('Depth map settings has been loaded from the file ' + fName)
 
@@ -134,18 +182,45 @@ load_map_settings("3dmap_set.txt")
 
 # Loading stereoscopic calibration data
 try:
-    npzfile = np.load('./calibration_data/{}p/stereo_camera_calibration.npz'.format(img_height))
+    # calibration is opened with mmap from uncompressed cache (built from npz on the first start)
+    npzfile = load_calibration('./calibration_data/{}p/stereo_camera_calibration.npz'.format(img_height))
 except:
     print("Camera calibration data not found in cache, file ",
           './calibration_data/{}p/stereo_camera_calibration.npz'.format(img_height))
     exit(0)
 
 imageSize = tuple(npzfile['imageSize'])
-leftMapX = npzfile['leftMapX']
-leftMapY = npzfile['leftMapY']
-rightMapX = npzfile['rightMapX']
-rightMapY = npzfile['rightMapY']
-QQ = npzfile['dispartityToDepthMap']
+# rectification maps are cropped to the strip from settings file (lidar-like mode saving CPU),
+# so only the pixels used by the matcher are remapped
+# (with a pipeline rectified strips go with the frame through disparity, ground, reduction, depth
+# and haptics stages and are shown with the last frame, so each of them needs its own output buffer)
+rectifier_buffers = Pipeline.output_buffers(5) if usePipeline else 1
+if stripImage:
+    rectifier = Rectifier(npzfile, "strip_set.txt", rectifier_buffers)
+else:
+    rectifier = Rectifier(npzfile, buffers=rectifier_buffers)
+# distances in metres for every disparity value (from calibrated disparity-to-depth matrix)
+depth_table = DepthTable(npzfile, MDS)
+if coarseToFine:
+    # disparity of the distance where motors can leave idle mode
+    alertDisparity = depth_table.disparity_at(motor_man.mapper.active_distance())
+    matcher = CoarseToFineMatcher(npzfile, rectifier, matcher, "3dmap_set.txt", alertDisparity, rectifier_buffers)
+# outputs of column statistics are used in turn, they are read by depth and haptics stages
+# (and shown with the last frame)
+column_stats = ColumnStatistics(columnStatistic, columnPercentile,
+                                Pipeline.output_buffers(2) if usePipeline else 1)
+# strip is cut to columns where matcher can find disparity, instead of hand-tuned cut of "nan" columns
+rectifier.set_disparity_range(matcher.min_disparity, matcher.num_disparities, matcher.block_size)
+ground_plane = None
+if removeGround and not useProcessPool:
+    # masked disparity maps are read by reduction, depth and haptics stages (and shown with the last frame)
+    ground_plane = GroundPlane(npzfile, depth_table, Pipeline.output_buffers(3) if usePipeline else 1)
+occupancy_grid = OccupancyGrid(npzfile, depth_table) if useOccupancyGrid and not useProcessPool else None
+governor = None
+if useGovernor and not coarseToFine and not useProcessPool:
+    governor = LatencyGovernor(targetLatency, log_name=governorLog)
+    quality_levels = [QualityLevel(level, npzfile, "3dmap_set.txt", "strip_set.txt" if stripImage else None,
+                                   matcherName, rectifier_buffers) for level in governor.levels]
 
 map_width = 640
 map_height = 480
@@ -154,75 +229,288 @@ min_y = 10000
 max_y = -10000
 min_x = 10000
 max_x = -10000
+# sequence number of the last processed pair
+last_seq = 0
+
+
+# Processing stages, each one takes frame dict from the previous stage and adds own results to it
+def capture_frame():
+    global last_seq
+    # waiting for a new pair instead of processing the same frames again
+    lease = man.lease_pair(last_seq, timeout=1.)
+    if lease is None:
+        if not man.running:
+            # cameras are lost or replay is finished
+            raise StopIteration
+        return None
+    last_seq = lease.seq
+    # capture time of the pair starts latency marks of the frame
+    frame = {'lease': lease, 'seq': lease.seq, 'marks': [('capture', lease.timestamp)]}
+    mark(frame, 'camera')
+    return frame
+
+
+def rectify_frame(frame):
+    # frames are already grayscale (camera gray mode), they are rectified into preallocated buffers
+    # and given back to the camera pool right away
+    lease = frame.pop('lease')
+    if coarseToFine:
+        # coarse pass, frames are kept for full resolution pass over alert columns
+        # (fine strip maps are kept too, strip settings can be reloaded before the frame is refined)
+        frame['disparity'], frame['rectified_pair'], frame['fine_maps'] = matcher.match_coarse(lease.left,
+                                                                                               lease.right)
+        frame['valid_columns'] = rectifier.valid_columns
+        frame['strip_left'] = rectifier.strip_left()
+        frame['strip_top'] = rectifier.strip_top()
+        frame['lease'] = lease
+        return frame
+    frame_rectifier = rectifier
+    if governor is not None:
+        # level is taken once, so the frame is matched with the same level it's rectified with
+        frame['level'] = quality_levels[governor.level]
+        frame_rectifier = frame['level'].rectifier
+    with lease:
+        frame['rectified_pair'] = frame_rectifier.rectify(lease.left, lease.right)
+    frame['valid_columns'] = frame_rectifier.valid_columns if governor is None else frame['level'].valid_columns()
+    frame['strip_left'] = frame_rectifier.strip_left()
+    frame['strip_top'] = frame_rectifier.strip_top()
+    return frame
+
+
+def compute_disparity(frame):
+    if coarseToFine:
+        lease = frame.pop('lease')
+        with lease:
+            frame['disparity'] = matcher.refine(frame['disparity'], lease.left, lease.right, frame.pop('fine_maps'))
+        return frame
+    if 'level' in frame:
+        frame['disparity'] = frame['level'].compute(frame['rectified_pair'])
+        return frame
+    frame['disparity'] = stereo_depth_map(frame['rectified_pair'])
+    return frame
+
+
+def remove_ground(frame):
+    # floor pixels are set invalid, so they don't count in column statistics
+    if ground_plane is not None:
+        frame['disparity'] = ground_plane.mask(frame['disparity'], frame['valid_columns'], frame['strip_left'],
+                                               frame['strip_top'])
+    return frame
+
+
+def reduce_columns(frame):
+    # calculation mean (or chosen statistic) distance in each column excluding values below zero
+    # (only for columns with valid disparity)
+    frame['max_in_columns'] = column_values(frame['disparity'], column_stats, frame['valid_columns'])
+    # calculating max value in each quater (num of motors==4)
+    frame['sectors'] = sector_maxima(frame['max_in_columns'])
+    return frame
+
+
+def measure_depth(frame):
+    # distances in metres of the nearest obstacle in each sector
+    frame['sector_distances'] = depth_table.distances(frame['sectors'])
+    if occupancy_grid is not None:
+        # motors are driven by obstacles fused in the grid instead of the current frame only
+        occupancy_grid.update(frame['disparity'], frame['valid_columns'], frame['strip_left'])
+        frame['sector_distances'] = occupancy_grid.sector_distances()
+        frame['grid'] = occupancy_grid.cells.copy()
+    return frame
+
+
+def set_motor_modes(distances, marks):
+    # latency marks of the frame end when new modes are applied, returns latency from capture
+    pulse = motor_man.set_distances(distances)
+    marks.append(('haptics', time.monotonic()))
+    total = latency_stats.add_marks(marks)
+    if pulse is not None:
+        # motor scheduling: waiting for the first pulse of a changed mode (pulse due right away
+        # is stamped by set_mode a bit before the haptics mark)
+        latency_stats.add('first_pulse', max(0., pulse - marks[-1][1]))
+        latency_stats.add('total_to_pulse', pulse - marks[0][1])
+    return total
+
+
+def update_motors(frame):
+    total = set_motor_modes(frame['sector_distances'], frame['marks'])
+    if governor is not None:
+        governor.add_latency(total, pipeline.get_last_times() if pipeline is not None else None)
+    return frame
+
+
+# latency marks of frames being processed by disparity workers
+pool_frame_marks = dict()
+
+
+def start_disparity_pool():
+    return DisparityPool(rectifier.strip_shape(), "3dmap_set.txt", on_result=apply_sectors,
+                         matcher_name=matcherName, statistic=columnStatistic, percentile=columnPercentile)
+
+
+def submit_frame(frame):
+    # rectified pair is written right into shared memory slot of disparity workers
+    global disparity_pool
+    lease = frame.pop('lease')
+    with lease:
+        rectifier.check_settings()
+        if rectifier.strip_shape() != disparity_pool.shape:
+            # strip settings are changed, slots are recreated for the new strip
+            disparity_pool.stop()
+            disparity_pool = start_disparity_pool()
+        # lockstep replay waits for a free worker instead of dropping the pair
+        slot = disparity_pool.acquire_slot(wait=man.lockstep)
+        if slot is None:
+            # all workers are busy, frame is dropped
+            return None
+        slot_number, slot_left, slot_right = slot
+        rectifier.rectify(lease.left, lease.right, out=(slot_left, slot_right))
+    mark(frame, 'submit')
+    pool_frame_marks[frame['seq']] = frame['marks']
+    disparity_pool.submit(slot_number, frame['seq'], rectifier.valid_columns)
+    return None
+
+
+def apply_sectors(seq, sectors):
+    # called by disparity pool for every computed pair
+    set_motor_modes(depth_table.distances(sectors), pool_frame_marks.pop(seq))
+
+
+def release_frame(frame):
+    # frames dropped by pipeline give camera buffers back
+    if 'lease' in frame:
+        frame['lease'].release()
+
+
+def show_frame(frame):
+    # visualization is done in main thread, returns True if 'Q' is pressed
+    global autotune_min, autotune_max
+    maximized_line = frame['disparity']
+    maxInColumns = frame['max_in_columns']
+    imgLcut, imgRcut = frame['rectified_pair']
+    if (showDisparity):
+        disparity_grayscale = (maximized_line - autotune_min) * (65535.0 / (autotune_max - autotune_min))
+        disparity_fixtype = cv2.convertScaleAbs(disparity_grayscale, alpha=(255.0 / 65535.0))
+        disparity_color = cv2.applyColorMap(disparity_fixtype, cv2.COLORMAP_JET)
+        cv2.imshow("Image", disparity_color)
+    if showColorizedDistanceLine or showUndistortedImages:
+        # "Jumping colors" protection for depth map visualization
+        if autotune_max < np.amax(maximized_line):
+            autotune_max = np.amax(maximized_line)
+        if autotune_min > np.amin(maximized_line):
+            autotune_min = np.amin(maximized_line)
+        # Colorizing final line
+        res = [maxInColumns] * 40
+        max_line_tune = (res - autotune_min) * (65535.0 / (autotune_max - autotune_min))
+        max_line_gray = cv2.convertScaleAbs(max_line_tune, alpha=(255.0 / 65535.0))
+
+        # Change map_zoom to adjust visible range!
+        max_line_color = cv2.applyColorMap(max_line_gray, cv2.COLORMAP_JET)
+
+        # show the frame
+        # print ("Autotune: min =", autotune_min, " max =", autotune_max)
+        if (showUndistortedImages):
+            cv2.imshow("left", imgLcut)
+            cv2.imshow("right", imgRcut)
+        if (showColorizedDistanceLine):
+            cv2.imshow("Max distance line", max_line_color)
+    showGrid = showOccupancyGrid and 'grid' in frame
+    if showGrid:
+        # the nearest range at the bottom, bearing from left to right
+        grid_gray = cv2.convertScaleAbs(np.flipud(frame['grid']), alpha=255.)
+        grid_image = cv2.resize(grid_gray, (map_width // 2, map_height // 2), interpolation=cv2.INTER_NEAREST)
+        cv2.imshow("Occupancy grid", cv2.applyColorMap(grid_image, cv2.COLORMAP_JET))
+    if showDisparity or showColorizedDistanceLine or showUndistortedImages or showGrid:
+        key = cv2.waitKey(1) & 0xFF
+        return key == ord("q")
+    return False
+
+
+if useProcessPool:
+    disparity_pool = start_disparity_pool()
+    stages = [('capture', capture_frame), ('submit', submit_frame)]
+else:
+    disparity_pool = None
+    stages = [('rectify', rectify_frame), ('disparity', compute_disparity), ('ground', remove_ground),
+              ('reduction', reduce_columns), ('depth', measure_depth)]
+    # stages mark their end time in frames for latency stats (haptics marks when modes are applied)
+    stages = [('capture', capture_frame)] + [(name, timed_stage(name, stage)) for name, stage in stages] + \
+             [('haptics', update_motors)]
+pipeline = None
 # Capture the frames from the camera
 try:
-    while 1:
-        t1 = datetime.now()
-        imgLeft, imgRight = man.get_stereo()
-        imgLeft = cv2.cvtColor(imgLeft, cv2.COLOR_BGR2GRAY)
-        imgRight = cv2.cvtColor(imgRight, cv2.COLOR_BGR2GRAY)
-        imgL = cv2.remap(imgLeft, leftMapX, leftMapY, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
-        imgR = cv2.remap(imgRight, rightMapX, rightMapY, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
-
-        # Taking a strip from our image for saving CPU (or using lidar-like mode)
-        if stripImage:
-            imgRcut = imgR[100:-100, :]
-            imgLcut = imgL[100:-100, :]
-        else:
-            imgRcut = imgR
-            imgLcut = imgL
-        rectified_pair = (imgLcut, imgRcut)
-
-        # Disparity map calculation
-        native_disparity = stereo_depth_map(rectified_pair)
-        maximized_line = native_disparity
-        # calculation mean distance in each column excluding values below zero
-        maxInColumns = []
-        rotated_lines = np.rot90(maximized_line, k=-1)
-        for i in range(len(rotated_lines)):
-            arr = rotated_lines[i]
-            maxInColumns.append(np.mean(arr[arr > 0]))
-        # cutting off constant "nan" values because of preset disparity num (in DM calibration)
-        # change slice indexes manualy for your calibration settings
-        maxInColumns = maxInColumns[110:-20]
-
-        quat_length = len(maxInColumns) // 4
-        # calculating max value in each quater (num of motors==4) and setting motors' modes
-        motor_man.set_mode(MOTOR_PIN_1, motor_man.get_needed_mode(np.amax(maxInColumns[:quat_length])))
-        motor_man.set_mode(MOTOR_PIN_2, motor_man.get_needed_mode(np.amax(maxInColumns[quat_length:quat_length * 2])))
-        motor_man.set_mode(MOTOR_PIN_3,
-                           motor_man.get_needed_mode(np.amax(maxInColumns[quat_length * 2:quat_length * 3])))
-        motor_man.set_mode(MOTOR_PIN_4, motor_man.get_needed_mode(np.amax(maxInColumns[quat_length * 3:])))
-        print()
-
-        if showColorizedDistanceLine or showUndistortedImages:
-            # "Jumping colors" protection for depth map visualization
-            if autotune_max < np.amax(maximized_line):
-                autotune_max = np.amax(maximized_line)
-            if autotune_min > np.amin(maximized_line):
-                autotune_min = np.amin(maximized_line)
-            # Colorizing final line
-            res = [maxInColumns] * 40
-            max_line_tune = (res - autotune_min) * (65535.0 / (autotune_max - autotune_min))
-            max_line_gray = cv2.convertScaleAbs(max_line_tune, alpha=(255.0 / 65535.0))
-
-            # Change map_zoom to adjust visible range!
-            max_line_color = cv2.applyColorMap(max_line_gray, cv2.COLORMAP_JET)
-
-            # show the frame
-            # print ("Autotune: min =", autotune_min, " max =", autotune_max)
-            if (showUndistortedImages):
-                cv2.imshow("left", imgLcut)
-                cv2.imshow("right", imgRcut)
-            if (showColorizedDistanceLine):
-                cv2.imshow("Max distance line", max_line_color)
-        t2 = datetime.now()
-        print("DM build time: " + str(t2 - t1))
+    if usePipeline:
+        # lockstep replay (not realtime) must process every pair once, so queues don't drop frames
+        pipeline = Pipeline(stages, on_drop=release_frame, blocking=man.lockstep)
+        pipeline.start()
+        shown_frame = None
+        stats_time = time.time()
+        while pipeline.is_alive():
+            if disparity_pool is not None:
+                # error of disparity workers stops everything like an error of pipeline stage
+                disparity_pool.check_error()
+            # showing the newest processed frame
+            frame = pipeline.last_result
+            if frame is None or frame is shown_frame:
+                time.sleep(0.005)
+                continue
+            shown_frame = frame
+            if show_frame(frame):
+                break
+            if time.time() - stats_time > 5:
+                pipeline.print_stats()
+                latency_stats.print_stats()
+                stats_time = time.time()
+        pipeline.check_error()
+        if disparity_pool is not None:
+            disparity_pool.check_error()
+    else:
+        while 1:
+            try:
+                frame = capture_frame()
+            except StopIteration:
+                break
+            if frame is None:
+                continue
+            for name, stage in stages[1:]:
+                frame = stage(frame)
+            if frame is not None and show_frame(frame):
+                break
 
 finally:
-    # it's strongly recommended to use
-    # try-finally syntax to stop cameraand motor threads correctly
-    man.stop()
-    motor_man.set_all_idle()
-    motor_man.stop()
-    sleep(2)
+    # motors are turned off even if stopping something else fails
+    try:
+        if pipeline is not None:
+            pipeline.stop()
+            pipeline.print_stats()
+        if disparity_pool is not None:
+            disparity_pool.stop()
+            print('Disparity workers:', disparity_pool.get_stats())
+        print('Latency from capture, by stages:')
+        latency_stats.print_stats()
+        if latencyDump is not None:
+            latency_stats.dump(latencyDump)
+        print('Camera counters:', man.get_counters())
+        if ground_plane is not None:
+            print('Ground plane:', ground_plane.get_stats())
+        if occupancy_grid is not None:
+            print('Occupancy grid:', occupancy_grid.get_stats())
+        if coarseToFine:
+            print('Coarse to fine:', matcher.get_stats())
+        elif incrementalDisparity:
+            print('Incremental disparity:', matcher.get_stats())
+        if governor is not None:
+            print('Latency governor:', governor.get_stats())
+            for level in quality_levels:
+                level.stop()
+        matcher.stop()
+        # it's strongly recommended to use
+        # try-finally syntax to stop cameraand motor threads correctly
+        man.stop()
+        sleep(2)
+    finally:
+        motor_man.set_all_idle()
+        motor_man.stop()
+        print('Motors:', motor_man.get_stats())
+        if actuation_recorder is not None:
+            actuation_recorder.save(actuationLog)
+            print_report(analyze(actuation_recorder.snapshot(), MotorManager.PULSE_TIME))
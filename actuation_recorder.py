@@ -0,0 +1,160 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import sys
+import numpy as np
+from threading import Lock
+from time import monotonic
+
+# kinds of records
+FALL = 0
+RISE = 1
+MODE = 2
+
+
+class ActuationRecorder:
+    # every output edge and mode change of MotorManager with monotonic time, written into
+    # preallocated ring buffer (the oldest records are overwritten), values are mode timeouts
+    SIZE = 100000
+
+    def __init__(self, size=SIZE):
+        self.times = np.zeros(size, np.float64)
+        self.pins = np.zeros(size, np.int32)
+        self.kinds = np.zeros(size, np.int8)
+        self.values = np.zeros(size, np.float64)
+        self.size = size
+        self.count = 0
+        self.lock = Lock()
+
+    def record(self, pin, kind, value=0., time=None):
+        with self.lock:
+            i = self.count % self.size
+            self.times[i] = monotonic() if time is None else time
+            self.pins[i] = pin
+            self.kinds[i] = kind
+            self.values[i] = value
+            self.count += 1
+
+    def record_edge(self, pin, high, time=None):
+        self.record(pin, RISE if high else FALL, time=time)
+
+    def record_mode(self, pin, timeout, time=None):
+        self.record(pin, MODE, timeout, time)
+
+    def snapshot(self):
+        # records in time order as dict of arrays
+        with self.lock:
+            order = np.arange(max(0, self.count - self.size), self.count) % self.size
+            return {'times': self.times[order], 'pins': self.pins[order], 'kinds': self.kinds[order],
+                    'values': self.values[order]}
+
+    def save(self, fName):
+        np.savez(fName, **self.snapshot())
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return None
+    return {'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)),
+            'p99': float(np.percentile(values, 99)), 'max': float(np.max(values))}
+
+
+def analyze(records, pulse_time=0.01):
+    # per motor pulse timing against intended mode (pulse of pulse_time every pulse_time + timeout):
+    # period error of pulses with the same mode (mean and jitter percentiles of its absolute value),
+    # pulse width error and latency from mode change to the first rising edge
+    report = dict()
+    for pin in np.unique(records['pins']):
+        mine = records['pins'] == pin
+        times, kinds, values = records['times'][mine], records['kinds'][mine], records['values'][mine]
+        # mode in effect and time of its change for every record
+        changes = np.flatnonzero(kinds == MODE)
+        segment = np.searchsorted(changes, np.arange(len(kinds)), side='right') - 1
+        rises = np.flatnonzero((kinds == RISE) & (segment >= 0))
+        falls = np.flatnonzero(kinds == FALL)
+        # periods between rises with the same mode
+        same = segment[rises[1:]] == segment[rises[:-1]]
+        periods = (times[rises[1:]] - times[rises[:-1]])[same]
+        intended = pulse_time + values[changes[segment[rises[1:]][same]]]
+        errors = periods - intended
+        # widths of pulses not cut by a mode change
+        next_falls = np.searchsorted(falls, rises)
+        ended = next_falls < len(falls)
+        ended[ended] = segment[falls[next_falls[ended]]] == segment[rises[ended]]
+        widths = times[falls[next_falls[ended]]] - times[rises[ended]]
+        # latency of mode changes to active modes which got a pulse before the next change
+        latencies = []
+        for i, change in enumerate(changes):
+            if abs(values[change]) < 0.001:
+                continue
+            end = changes[i + 1] if i + 1 < len(changes) else len(kinds)
+            first = rises[(rises > change) & (rises < end)]
+            if len(first):
+                latencies.append(times[first[0]] - times[change])
+        report[int(pin)] = {'pulses': len(rises), 'mode_changes': len(changes),
+                            'period_error_mean': float(errors.mean()) if len(errors) else None,
+                            'jitter': percentiles(np.abs(errors)),
+                            'width_error': percentiles(np.abs(widths - pulse_time)),
+                            'mode_latency': percentiles(np.array(latencies))}
+    return report
+
+
+def print_report(report):
+    def ms(stats):
+        if stats is None:
+            return '-'
+        return ' '.join('{} {:.2f}'.format(name, value * 1000) for name, value in stats.items())
+    for pin, stats in report.items():
+        print('motor {}: {} pulses, {} mode changes'.format(pin, stats['pulses'], stats['mode_changes']))
+        if stats['period_error_mean'] is not None:
+            print('  period error mean {:.2f} ms'.format(stats['period_error_mean'] * 1000))
+        print('  period jitter, ms:', ms(stats['jitter']))
+        print('  pulse width error, ms:', ms(stats['width_error']))
+        print('  mode change to first pulse, ms:', ms(stats['mode_latency']))
+
+
+if __name__ == '__main__':
+    # python3 actuation_recorder.py [saved .npz file]
+    # without a file, motors are run with mock backend through random modes for a few seconds
+    if len(sys.argv) > 1:
+        records = dict(np.load(sys.argv[1]))
+        print_report(analyze(records))
+    else:
+        from random import choice, random
+        from time import sleep
+        from motor_manager import MotorManager, PINS
+        recorder = ActuationRecorder()
+        manager = MotorManager(*PINS, backend='mock', recorder=recorder)
+        manager.start()
+        try:
+            modes = [MotorManager.IDLE, MotorManager.LOW, MotorManager.MEDIUM, MotorManager.HIGH,
+                     MotorManager.CRITICAL]
+            for i in range(20):
+                manager.set_mode(choice(PINS), choice(modes))
+                sleep(random() * 0.5)
+        finally:
+            manager.set_all_idle()
+            manager.stop()
+        print_report(analyze(recorder.snapshot(), MotorManager.PULSE_TIME))
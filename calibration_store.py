@@ -0,0 +1,126 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import os
+import json
+import hashlib
+import numpy as np
+
+# cache is a flat binary file: json header in the first page and then every array
+# starting from a page boundary, so arrays are opened with mmap without any decompression
+PAGE_SIZE = 4096
+CACHE_EXTENSION = '.cache'
+# caches of other versions are rebuilt (version 2: shapes of 0-d arrays are kept)
+CACHE_VERSION = 2
+
+
+def file_hash(fName):
+    sha = hashlib.sha1()
+    f = open(fName, 'rb')
+    for block in iter(lambda: f.read(1 << 20), b''):
+        sha.update(block)
+    f.close()
+    return sha.hexdigest()
+
+
+def align(offset):
+    return (offset + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+
+
+def read_header(cache_name):
+    f = open(cache_name, 'rb')
+    header = json.loads(f.read(PAGE_SIZE).decode())
+    f.close()
+    return header
+
+
+def write_header(f, header):
+    header_bytes = json.dumps(header).encode()
+    if len(header_bytes) > PAGE_SIZE:
+        raise ValueError('too many arrays for calibration cache header')
+    f.seek(0)
+    f.write(header_bytes.ljust(PAGE_SIZE, b' '))
+
+
+def build_cache(npz_name, cache_name, source):
+    # converting compressed npz (written by 4_calibration_fisheye.py) into the cache file
+    npzfile = np.load(npz_name)
+    arrays = {name: np.asarray(npzfile[name]) for name in npzfile.files}
+    header = {'version': CACHE_VERSION, 'source': source, 'arrays': dict()}
+    offset = PAGE_SIZE
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset}
+        offset = align(offset + array.nbytes)
+    # cache is replaced at once, so broken file is never left if writing is interrupted
+    f = open(cache_name + '.tmp', 'wb')
+    write_header(f, header)
+    for name, array in arrays.items():
+        f.seek(header['arrays'][name]['offset'])
+        f.write(array.tobytes())
+    f.truncate(offset)
+    f.close()
+    os.replace(cache_name + '.tmp', cache_name)
+    return header
+
+
+def load_calibration(npz_name):
+    # returns dict of calibration arrays opened with mmap from the cache of npz_name
+    # cache is rebuilt when the source npz hash changes
+    cache_name = os.path.splitext(npz_name)[0] + CACHE_EXTENSION
+    stat = os.stat(npz_name)
+    source = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    header = None
+    if os.path.isfile(cache_name):
+        header = read_header(cache_name)
+        cached = header['source']
+        if header.get('version') != CACHE_VERSION:
+            header = None
+        elif (cached['size'], cached['mtime']) != (source['size'], source['mtime']):
+            # file was touched or copied, only content matters
+            source['hash'] = file_hash(npz_name)
+            if source['hash'] != cached['hash']:
+                header = None
+            else:
+                # same content: remembering new size and time to skip hashing next time
+                header['source'] = source
+                try:
+                    f = open(cache_name, 'r+b')
+                    write_header(f, header)
+                    f.close()
+                except OSError:
+                    pass
+    if header is None:
+        print('Building calibration cache ' + cache_name)
+        source['hash'] = file_hash(npz_name)
+        try:
+            header = build_cache(npz_name, cache_name, source)
+        except OSError as e:
+            print('Calibration cache is not written:', e)
+            npzfile = np.load(npz_name)
+            return {name: npzfile[name] for name in npzfile.files}
+    # (memmap can't have 0-d shape, scalars are mapped as (1,) and reshaped to the saved shape)
+    return {name: np.memmap(cache_name, dtype=np.dtype(info['dtype']), mode='r',
+                            offset=info['offset'], shape=tuple(info['shape']) or (1,)).reshape(info['shape'])
+            for name, info in header['arrays'].items()}
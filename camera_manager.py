@@ -24,16 +24,95 @@
 
 
 import cv2
-from threading import Thread
-from time import sleep
+import numpy as np
+from collections import deque, namedtuple
+from threading import Thread, Condition, Lock
+from time import sleep, monotonic
+
+# one stereo pair with monotonic capture time (middle of both grabs), skew between grabs (seconds)
+# and sequence number (increases by 1 with each captured pair, starting from 1)
+StereoPair = namedtuple('StereoPair', ['left', 'right', 'timestamp', 'skew', 'seq'])
+
+
+# func for taking Y plane (luma) out of raw camera frame without any colour conversion
+def extract_luma(raw, dst=None, width=0, height=0):
+    if raw.ndim == 3 and raw.shape[2] == 2:
+        # YUYV: Y is every even byte
+        return cv2.cvtColor(raw, cv2.COLOR_YUV2GRAY_YUY2, dst=dst)
+    if raw.ndim == 3 and raw.shape[2] == 3:
+        # camera (or replay) refused raw format, converting in capture thread
+        return cv2.cvtColor(raw, cv2.COLOR_BGR2GRAY, dst=dst)
+    if raw.size == width * height * 2:
+        # some backends give raw YUYV as a flat byte array
+        return cv2.cvtColor(raw.reshape(height, width, 2), cv2.COLOR_YUV2GRAY_YUY2, dst=dst)
+    # frame is already single-channel
+    if dst is None or dst.shape != raw.shape:
+        return raw.copy()
+    dst[...] = raw
+    return dst
+
+
+class FramePool:
+    # fixed set of reusable frame buffers, capture threads retrieve frames right into them
+    def __init__(self, size):
+        self.size = size
+        self.shape = None
+        self.dtype = None
+        self.free = []
+        self.lock = Lock()
+
+    def acquire(self):
+        # free buffer or None (if pool isn't set up yet or all buffers are in use)
+        with self.lock:
+            return self.free.pop() if self.free else None
+
+    def release(self, buffer):
+        with self.lock:
+            # buffers of old shape are just forgotten after setup for new frame shape
+            if buffer.shape == self.shape and buffer.dtype == self.dtype and len(self.free) < self.size:
+                self.free.append(buffer)
+
+    def setup(self, frame):
+        # first frame (or frame of new shape) defines buffers, frame itself becomes one of them
+        with self.lock:
+            self.shape, self.dtype = frame.shape, frame.dtype
+            self.free = [np.empty(frame.shape, frame.dtype) for i in range(self.size - 1)]
+
+
+class FrameLease:
+    # handle of a pooled stereo pair, frames are valid until release()
+    def __init__(self, manager, pair):
+        self.manager = manager
+        self.pair = pair
+        self.left, self.right = pair.left, pair.right
+        self.timestamp, self.skew, self.seq = pair.timestamp, pair.skew, pair.seq
+
+    def release(self):
+        if self.pair is not None:
+            self.manager.release_pair(self.pair)
+            self.pair = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
 
 
 # func for updating left image in thread
 def renew_left(manager):
     try:
         while manager.running:
-            success_l, left = manager.left_cap.read()
-            manager.left_frame = left
+            if not manager.left_cap.grab():
+                if not manager.left_cap.isOpened():
+                    # camera is lost or replay is finished
+                    manager.stop()
+                sleep(0.01)
+                continue
+            grab_time = monotonic()
+            left = manager.retrieve(manager.left_cap, manager.left_pool)
+            if left is not None:
+                manager.add_frame(True, left, grab_time)
     finally:
         manager.left_cap.release()
 
@@ -42,18 +121,75 @@ def renew_left(manager):
 def renew_right(manager):
     try:
         while manager.running:
-            success_r, right = manager.right_cap.read()
-            manager.right_frame = right
+            if not manager.right_cap.grab():
+                if not manager.right_cap.isOpened():
+                    manager.stop()
+                sleep(0.01)
+                continue
+            grab_time = monotonic()
+            right = manager.retrieve(manager.right_cap, manager.right_pool)
+            if right is not None:
+                manager.add_frame(False, right, grab_time)
+    finally:
+        manager.right_cap.release()
+
+
+# func for capturing both images in one thread (synchronized mode)
+def renew_pair(manager):
+    try:
+        while manager.running:
+            if manager.lockstep:
+                # replay benchmark mode: next pair is captured only after the previous one was consumed
+                manager.wait_consumed()
+            # grab() only latches frames, so both cameras are triggered back to back
+            # and slow decoding (retrieve) is done after that
+            success_l = manager.left_cap.grab()
+            left_time = monotonic()
+            success_r = manager.right_cap.grab()
+            right_time = monotonic()
+            if not (success_l and success_r):
+                if not (manager.left_cap.isOpened() and manager.right_cap.isOpened()):
+                    manager.stop()
+                sleep(0.01)
+                continue
+            left = manager.retrieve(manager.left_cap, manager.left_pool)
+            right = manager.retrieve(manager.right_cap, manager.right_pool)
+            if left is not None and right is not None:
+                manager.add_pair(left, right, (left_time + right_time) / 2, right_time - left_time)
+            else:
+                # returning buffer of the half-taken pair
+                manager.release_buffer(manager.left_pool, left)
+                manager.release_buffer(manager.right_pool, right)
     finally:
+        manager.left_cap.release()
         manager.right_cap.release()
 
 
 class CameraManager:
-    def __init__(self):
-        self.left_cap = cv2.VideoCapture(2)
-        self.right_cap = cv2.VideoCapture(0)
-        self.left_cap.set(cv2.CAP_PROP_FPS, 10)
-        self.right_cap.set(cv2.CAP_PROP_FPS, 10)
+    # vars preset for faster customisation
+    FPS = 10
+    MAX_SKEW = 0.02  # max time between left and right shots of a good pair (seconds)
+    PAIRS_BUFFER_SIZE = 4
+    FRAME_LEASES = 2  # leased pairs consumers can hold at the same time without capture skipping frames
+
+    def __init__(self, synchronized=False, max_skew=MAX_SKEW, buffer_size=PAIRS_BUFFER_SIZE,
+                 left_cap=None, right_cap=None, lockstep=False, pooled=True, gray=False):
+        # any objects with cv2.VideoCapture interface can be used as sources (see replay_source.py)
+        if left_cap is None or right_cap is None:
+            left_cap = cv2.VideoCapture(2)
+            right_cap = cv2.VideoCapture(0)
+            left_cap.set(cv2.CAP_PROP_FPS, CameraManager.FPS)
+            right_cap.set(cv2.CAP_PROP_FPS, CameraManager.FPS)
+        self.left_cap = left_cap
+        self.right_cap = right_cap
+        # gray mode asks cameras for raw YUYV and gives single-channel frames (Y plane only)
+        self.gray = gray
+        # reusable buffers for raw frames before Y plane extraction (by id of capture)
+        self.raw_frames = dict()
+        if gray:
+            for cap in (left_cap, right_cap):
+                cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'YUYV'))
+                cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
         try:
             assert self.left_cap.isOpened() and self.right_cap.isOpened()
         except AssertionError:
@@ -62,6 +198,41 @@ class CameraManager:
         self.left_frame = None
         self.right_frame = None
 
+        # synchronized mode grabs both cameras in one thread, otherwise each camera has own thread
+        self.synchronized = synchronized
+        # lockstep (synchronized mode only) doesn't drop frames: capture waits for consumer
+        self.lockstep = lockstep and synchronized
+        self.max_skew = max_skew
+        # ring buffer of last stereo pairs (newest is the last one)
+        self.pairs = deque()
+        self.buffer_size = buffer_size
+        # pooled mode retrieves frames into preallocated buffers, which are given back
+        # when pair leaves ring buffer and all its leases are released
+        # (+2 buffers for frame being retrieved and frame waiting for a pair)
+        self.pooled = pooled
+        self.left_pool = FramePool(buffer_size + CameraManager.FRAME_LEASES + 2) if pooled else None
+        self.right_pool = FramePool(buffer_size + CameraManager.FRAME_LEASES + 2) if pooled else None
+        # references to pairs by seq (ring buffer and leases)
+        self.refs = dict()
+        # condition is used both as a lock for pairs and for waking up consumers on a new pair
+        self.condition = Condition()
+        self.seq = 0
+        # counters for estimating how much of the compute budget goes to duplicates
+        self.frames_captured = 0
+        self.frames_consumed = 0
+        self.frames_dropped = 0
+        self.frames_reused = 0
+        self.frames_skipped = 0
+        self.last_consumed_seq = 0
+        # functions called from capture threads with every captured pair (e.g. StereoRecorder.add_pair),
+        # they get copies of pooled frames and must not block (consumer counters aren't changed)
+        self.listeners = []
+        # capture times of the last frames and flags of frames not yet paired (free-running mode)
+        self.left_time = None
+        self.right_time = None
+        self.left_fresh = False
+        self.right_fresh = False
+
         self.running = False
         self.start()
 
@@ -71,18 +242,195 @@ class CameraManager:
         sleep(1.)
 
     def start_threads(self):
+        if self.synchronized:
+            Thread(target=renew_pair, args=(self,)).start()
+            return
         # starting 2 threads with funcs above and self argument
         Thread(target=renew_left, args=(self,)).start()
         Thread(target=renew_right, args=(self,)).start()
 
     def stop(self):
         self.running = False
+        with self.condition:
+            self.condition.notify_all()
+
+    def retrieve(self, cap, pool):
+        # retrieving grabbed frame (into pool buffer in pooled mode), returns None on failure
+        buffer = None
+        if pool is not None:
+            buffer = pool.acquire()
+            if buffer is None and pool.shape is not None:
+                # all buffers are in use: giving back buffers of the oldest pairs in ring buffer
+                self.reclaim(pool)
+                buffer = pool.acquire()
+                if buffer is None:
+                    # consumers hold too many leases, frame is skipped
+                    with self.condition:
+                        self.frames_skipped += 1
+                    return None
+        if self.gray:
+            frame = self.retrieve_luma(cap, buffer)
+        else:
+            success, frame = cap.retrieve(buffer)
+            if not success:
+                frame = None
+        if frame is None:
+            self.release_buffer(pool, buffer)
+            return None
+        if pool is not None and frame is not buffer:
+            pool.setup(frame)
+        return frame
+
+    def retrieve_luma(self, cap, buffer):
+        success, raw = cap.retrieve(self.raw_frames.get(id(cap)))
+        if not success:
+            return None
+        self.raw_frames[id(cap)] = raw
+        return extract_luma(raw, buffer, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                            int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def release_buffer(self, pool, buffer):
+        if pool is not None and buffer is not None:
+            pool.release(buffer)
+
+    def reclaim(self, pool):
+        with self.condition:
+            while len(self.pairs) > 1 and not pool.free:
+                self.unref(self.pairs.popleft())
+
+    def unref(self, pair):
+        # must be called with self.condition acquired
+        self.refs[pair.seq] -= 1
+        if self.refs[pair.seq] == 0:
+            del self.refs[pair.seq]
+            self.release_buffer(self.left_pool, pair.left)
+            self.release_buffer(self.right_pool, pair.right)
+
+    def release_pair(self, pair):
+        with self.condition:
+            self.unref(pair)
+
+    def add_frame(self, is_left, frame, timestamp):
+        # called from free-running threads, pair is made when both sides have new frames
+        with self.condition:
+            # unpaired frame replaced by a newer one goes back to the pool
+            if is_left and self.left_fresh:
+                self.release_buffer(self.left_pool, self.left_frame)
+            if not is_left and self.right_fresh:
+                self.release_buffer(self.right_pool, self.right_frame)
+            if is_left:
+                self.left_frame, self.left_time, self.left_fresh = frame, timestamp, True
+            else:
+                self.right_frame, self.right_time, self.right_fresh = frame, timestamp, True
+            if not (self.left_fresh and self.right_fresh):
+                return
+            self.left_fresh = self.right_fresh = False
+            self.push_pair(self.left_frame, self.right_frame,
+                           (self.left_time + self.right_time) / 2, abs(self.right_time - self.left_time))
+
+    def add_pair(self, left, right, timestamp, skew):
+        with self.condition:
+            self.left_frame, self.left_time = left, timestamp
+            self.right_frame, self.right_time = right, timestamp
+            self.push_pair(left, right, timestamp, skew)
+
+    def push_pair(self, left, right, timestamp, skew):
+        # must be called with self.condition acquired
+        self.seq += 1
+        self.frames_captured += 1
+        pair = StereoPair(left, right, timestamp, skew, self.seq)
+        # listeners get the pair before it can leave the ring buffer (and give its frames back to the pool)
+        for listener in self.listeners:
+            listener(self.copy_pair(pair))
+        self.pairs.append(pair)
+        self.refs[self.seq] = 1
+        if len(self.pairs) > self.buffer_size:
+            self.unref(self.pairs.popleft())
+        self.condition.notify_all()
+
+    def add_listener(self, listener):
+        with self.condition:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.condition:
+            self.listeners.remove(listener)
+
+    def choose_pair(self, after_seq=0):
+        # newest pair after after_seq within skew tolerance (or the least skewed one if there is no such pair)
+        # must be called with self.condition acquired
+        pairs = [pair for pair in self.pairs if pair.seq > after_seq]
+        for pair in reversed(pairs):
+            if pair.skew <= self.max_skew:
+                return pair
+        return min(pairs, key=lambda p: p.skew, default=None)
+
+    def consume(self, pair):
+        # updating counters, must be called with self.condition acquired
+        if pair.seq <= self.last_consumed_seq:
+            self.frames_reused += 1
+            return
+        self.frames_dropped += pair.seq - self.last_consumed_seq - 1
+        self.frames_consumed += 1
+        self.last_consumed_seq = pair.seq
+        if self.lockstep:
+            self.condition.notify_all()
+
+    def wait_consumed(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_consumed_seq >= self.seq or not self.running)
+
+    def lease_pair(self, after_seq=0, timeout=None):
+        # blocks until a pair newer than after_seq is captured and gives FrameLease for it
+        # returns None on timeout or when manager is stopped, don't forget to release() the lease
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > after_seq or not self.running, timeout):
+                return None
+            pair = self.choose_pair(after_seq)
+            if pair is None:
+                return None
+            self.consume(pair)
+            self.refs[pair.seq] += 1
+        return FrameLease(self, pair)
+
+    def copy_pair(self, pair):
+        # pooled buffers are reused by capture threads, so pairs given without lease are copied
+        if not self.pooled:
+            return pair
+        return pair._replace(left=pair.left.copy(), right=pair.right.copy())
+
+    def get_stereo_pair(self):
+        # newest pair without waiting (None if nothing is captured yet)
+        return self.wait_for_pair(timeout=0)
+
+    def wait_for_pair(self, after_seq=0, timeout=None):
+        # same as lease_pair, but gives StereoPair which doesn't need release
+        lease = self.lease_pair(after_seq, timeout)
+        if lease is None:
+            return None
+        with lease:
+            return self.copy_pair(lease.pair)
+
+    def get_counters(self):
+        with self.condition:
+            return {'captured': self.frames_captured, 'consumed': self.frames_consumed,
+                    'dropped': self.frames_dropped, 'reused': self.frames_reused,
+                    'skipped': self.frames_skipped}
 
     def get_stereo(self):
-        return self.left_frame, self.right_frame
+        pair = self.get_stereo_pair()
+        if pair is None:
+            return self.get_left(), self.get_right()
+        return pair.left, pair.right
 
     def get_right(self):
-        return self.right_frame
+        with self.condition:
+            if self.pooled and self.right_frame is not None:
+                return self.right_frame.copy()
+            return self.right_frame
 
     def get_left(self):
-        return self.left_frame
+        with self.condition:
+            if self.pooled and self.left_frame is not None:
+                return self.left_frame.copy()
+            return self.left_frame
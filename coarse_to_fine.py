@@ -0,0 +1,142 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import cv2
+import numpy as np
+from threading import Lock
+from matchers import BMMatcher, read_map_settings, half_settings
+from rectifier import Rectifier
+
+
+class CoarseToFineMatcher:
+    # two-level matching: the whole strip is matched at half resolution (about a quarter of work),
+    # and only column ranges where something is closer than alert disparity are rectified
+    # and matched again at full resolution
+    COARSE_BLOCK_SIZE = 11
+    ALERT_MARGIN = 0.8  # coarse values are less precise, so a bit farther objects are refined too
+    COLUMN_MARGIN = 16  # columns added to each side of refined ranges
+
+    def __init__(self, calibration, fine_rectifier, fine_matcher, settings_name, alert_disparity, buffers=1):
+        # coarse level uses half resolution maps of the same calibration as fine rectifier
+        # (separately calibrated 240p set rectifies to shifted and scaled images, so its columns and
+        # disparities can't be mapped to the fine strip), alert disparity is given in 1/16 px of full resolution
+        self.fine_rectifier = fine_rectifier
+        self.coarse_rectifier = Rectifier(calibration, fine_rectifier.settings_name, buffers, factor=2)
+        self.fine_matcher = fine_matcher
+        self.coarse_matcher = BMMatcher(block_size=CoarseToFineMatcher.COARSE_BLOCK_SIZE)
+        self.alert_disparity = alert_disparity
+        self.lock = Lock()
+        self.frames = 0
+        self.refined_columns = 0
+        self.total_columns = 0
+        self.load_settings(settings_name)
+
+    def configure(self, data):
+        self.fine_matcher.configure(data)
+        self.coarse_matcher.configure(half_settings(data))
+        self.min_disparity = self.fine_matcher.min_disparity
+        self.num_disparities = self.fine_matcher.num_disparities
+        self.block_size = self.fine_matcher.block_size
+        self.invalid = (data['minDisparity'] - 1) * 16
+
+    def load_settings(self, fName):
+        self.configure(read_map_settings(fName))
+
+    def coarse_transform(self):
+        # affine transform from coarse strip pixels to fine strip pixels
+        cy0, cy1, cx0, cx1 = self.coarse_rectifier.band
+        fy0, fy1, fx0, fx1 = self.fine_rectifier.band
+        return np.float32([[2, 0, 2 * cx0 + 0.5 - fx0], [0, 2, 2 * cy0 + 0.5 - fy0]])
+
+    def match_coarse(self, left, right):
+        # raw frames are downscaled, rectified and matched, returns coarse disparity upscaled
+        # to fine strip (disparity in 1/16 px of full resolution), coarse rectified pair and fine strip maps
+        # for refine() (strip settings of both levels are reloaded only here, so the map keeps its size
+        # even if the fine strip is changed before refining)
+        self.fine_rectifier.check_settings()
+        self.coarse_rectifier.check_settings()
+        fine_maps = self.fine_rectifier.maps
+        coarse_pair = self.coarse_rectifier.rectify(left, right)
+        coarse = self.coarse_matcher.compute(coarse_pair[0], coarse_pair[1])
+        coarse = np.where(coarse >= self.coarse_matcher.min_disparity * 16, coarse * 2, self.invalid)
+        fine_height, fine_width = self.fine_rectifier.strip_shape()
+        disparity = cv2.warpAffine(coarse.astype(np.int16), self.coarse_transform(), (fine_width, fine_height),
+                                   flags=cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT,
+                                   borderValue=self.invalid)
+        return disparity, coarse_pair, fine_maps
+
+    def alert_ranges(self, disparity):
+        # column ranges (of fine strip) where mean positive disparity is over alert level
+        positive = disparity > 0
+        counts = positive.sum(axis=0)
+        sums = np.where(positive, disparity, 0).sum(axis=0, dtype=np.float64)
+        means = np.divide(sums, counts, out=np.zeros(len(sums)), where=counts > 0)
+        alert = means > self.alert_disparity * CoarseToFineMatcher.ALERT_MARGIN
+        # growing ranges by the margin and merging them
+        margin = CoarseToFineMatcher.COLUMN_MARGIN
+        alert = np.convolve(alert, np.ones(2 * margin + 1), 'same') > 0
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], alert.astype(np.int8), [0]))))
+        return [(int(x0), int(x1)) for x0, x1 in zip(edges[::2], edges[1::2])]
+
+    def refine(self, disparity, left, right, fine_maps=None):
+        # rematching alert ranges of coarse disparity at full resolution in place, matcher input
+        # is wider than the range by disparity search range and block size, so refined columns
+        # are the same as from matching the whole strip before speckle filter; speckles are filtered
+        # by the fine matcher in each input range (the rest of the map is coarse, filtering the stitched
+        # map joins refined speckles with coarse values), so a speckle crossing the input range edge
+        # can differ from the whole strip result, fine_maps are the ones returned by match_coarse()
+        width = disparity.shape[1]
+        min_disparity = self.fine_matcher.min_disparity
+        margin = CoarseToFineMatcher.COLUMN_MARGIN
+        extra_left = max(0, min_disparity + self.fine_matcher.num_disparities) + margin
+        extra_right = max(0, -min_disparity) + margin
+        refined = 0
+        for x0, x1 in self.alert_ranges(disparity):
+            input_x0 = max(0, x0 - extra_left)
+            input_x1 = min(width, x1 + extra_right)
+            fine_left, fine_right = self.fine_rectifier.rectify_columns(left, right, input_x0, input_x1, fine_maps)
+            fine = self.fine_matcher.compute(fine_left, fine_right)
+            disparity[:, x0:x1] = fine[:, x0 - input_x0:x1 - input_x0]
+            refined += x1 - x0
+        with self.lock:
+            self.frames += 1
+            self.refined_columns += refined
+            self.total_columns += width
+        return disparity
+
+    def compute(self, left, right):
+        # disparity of fine strip from raw (not rectified) grayscale frames
+        disparity, coarse_pair, fine_maps = self.match_coarse(left, right)
+        return self.refine(disparity, left, right, fine_maps)
+
+    def get_stats(self):
+        # share of refined columns shows how much of full resolution work is done
+        with self.lock:
+            return {'frames': self.frames,
+                    'refined': self.refined_columns / self.total_columns if self.total_columns else 0.}
+
+    def stop(self):
+        self.coarse_matcher.stop()
+        self.fine_matcher.stop()
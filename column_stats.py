@@ -0,0 +1,149 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import sys
+import numpy as np
+from time import monotonic
+
+# per-column statistics of valid (positive) disparities
+STATISTICS = ('mean', 'max', 'percentile', 'count')
+
+
+class ColumnStatistics:
+    # masked statistics of all columns computed with array operations over preallocated buffers,
+    # columns without valid pixels give nan (like np.mean of empty array), 'count' gives number of them
+    PERCENTILE = 90
+
+    def __init__(self, statistic='mean', percentile=PERCENTILE, buffers=1):
+        if statistic not in STATISTICS:
+            print('wrong column statistic:', statistic)
+            raise ValueError
+        self.statistic = statistic
+        self.percentile = percentile
+        # outputs are used in turn (like Rectifier buffers), so results of previous frames
+        # stay valid for self.buffers calls
+        self.buffers = buffers
+        self.output_index = 0
+        self.shape = None
+
+    def setup(self, shape):
+        height, width = shape
+        self.shape = shape
+        self.mask = np.empty(shape, bool)
+        self.counts = np.empty(width, np.int64)
+        self.valid = np.empty(width, bool)
+        self.outputs = [np.empty(width, np.float64) for i in range(self.buffers)]
+        if self.statistic == 'mean':
+            self.masked = np.empty(shape, np.int32)
+            self.sums = np.empty(width, np.int64)
+        elif self.statistic == 'max':
+            self.maxima = np.empty(width, np.int16)
+        elif self.statistic == 'percentile':
+            self.sorted = np.empty(shape, np.int16)
+            self.rows = np.empty(width, np.float64)
+            self.lower = np.empty(width, np.int64)
+            self.columns = np.arange(width)
+
+    def compute(self, disparity):
+        if disparity.shape != self.shape:
+            self.setup(disparity.shape)
+        self.output_index = (self.output_index + 1) % self.buffers
+        output = self.outputs[self.output_index]
+        np.greater(disparity, 0, out=self.mask)
+        self.mask.sum(axis=0, out=self.counts)
+        np.greater(self.counts, 0, out=self.valid)
+        if self.statistic == 'count':
+            output[:] = self.counts
+            return output
+        if self.statistic == 'mean':
+            np.multiply(disparity, self.mask, out=self.masked)
+            self.masked.sum(axis=0, out=self.sums)
+            np.divide(self.sums, self.counts, out=output, where=self.valid)
+        elif self.statistic == 'max':
+            # max of valid pixels is max of the column when column has any of them
+            disparity.max(axis=0, out=self.maxima)
+            output[:] = self.maxima
+        else:
+            self.percentile_of_valid(disparity, output)
+        output[~self.valid] = np.nan
+        return output
+
+    def percentile_of_valid(self, disparity, output):
+        # columns are sorted with invalid pixels put first, percentile of the valid ones is
+        # interpolated between two neighbouring ranks (like np.percentile)
+        height = self.shape[0]
+        np.copyto(self.sorted, disparity)
+        np.putmask(self.sorted, ~self.mask, np.iinfo(np.int16).min)
+        self.sorted.sort(axis=0)
+        np.subtract(self.counts, 1, out=self.lower)
+        np.multiply(self.lower, self.percentile / 100, out=self.rows)
+        np.add(self.rows, height - self.counts, out=self.rows)
+        np.clip(self.rows, 0, height - 1, out=self.rows)
+        np.floor(self.rows, out=output)
+        self.lower[:] = output
+        below = self.sorted[self.lower, self.columns]
+        above = self.sorted[np.minimum(self.lower + 1, height - 1), self.columns]
+        fraction = self.rows - self.lower
+        np.multiply(above - below.astype(np.float64), fraction, out=output)
+        np.add(output, below, out=output)
+
+
+def column_means_loop(disparity):
+    # previous per-column loop (reference for benchmark)
+    maxInColumns = []
+    rotated_lines = np.rot90(disparity, k=-1)
+    for i in range(len(rotated_lines)):
+        arr = rotated_lines[i]
+        maxInColumns.append(np.mean(arr[arr > 0]))
+    return maxInColumns
+
+
+if __name__ == '__main__':
+    # benchmark against the loop: python3 column_stats.py [disparity .npy file]
+    import warnings
+    if len(sys.argv) > 1:
+        disparity = np.load(sys.argv[1])
+    else:
+        # strip-like map with invalid pixels and empty columns
+        generator = np.random.default_rng(0)
+        disparity = generator.integers(-300, 1700, (280, 640)).astype(np.int16)
+        disparity[:, :100] = -288
+    repeats = 50
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        t1 = monotonic()
+        for i in range(repeats):
+            reference = np.array(column_means_loop(disparity))
+        loop_time = (monotonic() - t1) / repeats
+    print('loop (mean): {:.2f} ms'.format(loop_time * 1000))
+    for statistic in STATISTICS:
+        stats = ColumnStatistics(statistic)
+        t1 = monotonic()
+        for i in range(repeats):
+            values = stats.compute(disparity)
+        line = '{}: {:.2f} ms'.format(statistic, (monotonic() - t1) / repeats * 1000)
+        if statistic == 'mean':
+            line += ', max difference with loop {}'.format(np.nanmax(np.abs(values - reference)))
+        print(line)
@@ -0,0 +1,59 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import numpy as np
+
+# metres in a unit of calibration for calibrations saved without depthUnit: object points in
+# 4_calibration_fisheye.py are given in chessboard squares (square_size is 2.5 cm)
+DEPTH_UNIT = 0.025
+
+
+class DepthTable:
+    # distance in metres for every possible int16 disparity (in 1/16 px) of the matcher,
+    # built from disparity-to-depth matrix of calibration: depth = Q[2][3] / (Q[3][2] * d + Q[3][3]),
+    # so distance of a pixel or a column is one table index instead of reprojectImageTo3D
+    def __init__(self, calibration, min_disparity=0):
+        self.q = np.asarray(calibration['dispartityToDepthMap'], np.float64)
+        self.unit = np.asarray(calibration['depthUnit']).item() if 'depthUnit' in calibration else DEPTH_UNIT
+        # table is indexed by disparity bits taken as uint16
+        disparities = np.arange(65536, dtype=np.uint16).view(np.int16)
+        w = self.q[3][2] * (disparities / 16) + self.q[3][3]
+        depth = np.divide(self.q[2][3] * self.unit, w, out=np.full(65536, np.inf), where=w > 0)
+        # invalid disparities (below minDisparity) and points at infinity are infinitely far
+        depth[disparities < min_disparity * 16] = np.inf
+        self.table = depth.astype(np.float32)
+
+    def lookup(self, disparity):
+        # distances of int16 disparity map (or any int16 array)
+        return self.table[disparity.view(np.uint16)]
+
+    def distances(self, values):
+        # distances of column (or sector) disparity values, nan (no valid pixels) is infinitely far
+        values = np.nan_to_num(np.asarray(values, np.float64), nan=-32768.)
+        return self.lookup(np.clip(np.round(values), -32768, 32767).astype(np.int16))
+
+    def disparity_at(self, distance):
+        # disparity (in 1/16 px) of the point at distance in metres
+        return (self.q[2][3] * self.unit / distance - self.q[3][3]) / self.q[3][2] * 16
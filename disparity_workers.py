@@ -0,0 +1,207 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import cv2
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from queue import Empty
+from threading import Thread, Condition
+from time import monotonic
+from matchers import make_matcher
+from column_stats import ColumnStatistics
+
+SECTORS = 4
+
+
+def column_values(disparity, stats, columns):
+    # statistic of valid disparities (ColumnStatistics) in each column of range where matcher can find
+    # disparity (Rectifier.valid_columns), the rest are constant "nan" columns
+    return stats.compute(disparity[:, columns[0]:columns[1]])
+
+
+def sector_maxima(maxInColumns, sectors=SECTORS):
+    # max value in each sector (one sector for each motor), the last sector takes the rest of columns,
+    # columns without valid pixels (nan) are skipped (nan only if the whole sector is empty)
+    length = len(maxInColumns) // sectors
+    return [np.fmax.reduce(maxInColumns[i * length:(i + 1) * length if i < sectors - 1 else len(maxInColumns)])
+            for i in range(sectors)]
+
+
+# func running in worker process: only slot numbers go through queues, frames are in shared memory
+def disparity_worker(shm_names, shape, settings_name, matcher_name, statistic, percentile, tasks, results):
+    cv2.setNumThreads(1)
+    matcher = make_matcher(matcher_name, settings_name)
+    stats = ColumnStatistics(statistic, percentile)
+    memories = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    slots = [np.ndarray((2,) + shape, np.uint8, buffer=memory.buf) for memory in memories]
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, seq, columns = task
+            t1 = monotonic()
+            try:
+                disparity = matcher.compute(slots[slot][0], slots[slot][1])
+                sectors = [float(value) for value in sector_maxima(column_values(disparity, stats, columns))]
+            except Exception as e:
+                # slot is given back with the error instead of sectors, so it isn't lost
+                results.put((slot, seq, None, monotonic() - t1, repr(e)))
+                continue
+            results.put((slot, seq, sectors, monotonic() - t1, None))
+    finally:
+        del slots
+        for memory in memories:
+            memory.close()
+
+
+# func for collecting results of workers in thread of the main process
+def collect_results(pool):
+    while pool.running or (pool.busy_slots() and pool.error is None):
+        dead = [worker.exitcode for worker in pool.workers if not worker.is_alive()]
+        if dead and pool.error is None:
+            # slot of a crashed worker is never given back, so waiting for it would block forever
+            pool.fail(RuntimeError('disparity worker exited with code {}'.format(dead[0])))
+        try:
+            slot, seq, sectors, compute_time, error = pool.results.get(timeout=0.1)
+        except Empty:
+            continue
+        pool.release_slot(slot, compute_time)
+        if error is not None:
+            with pool.lock:
+                pool.failed += 1
+            pool.fail(RuntimeError('disparity worker failed on frame {}: {}'.format(seq, error)))
+            continue
+        if pool.on_result is not None:
+            try:
+                pool.on_result(seq, sectors)
+            except Exception as e:
+                pool.fail(e)
+
+
+class DisparityPool:
+    # worker processes compute disparity and sector values of rectified pairs in shared memory slots,
+    # so Python-side work is not serialized by GIL and frames are never pickled
+    WORKERS = 3
+    SLOT_TIMEOUT = 10.  # seconds to wait for a free slot (with wait=True) before the pool is treated as stuck
+
+    def __init__(self, shape, settings_name, on_result=None, workers=WORKERS, slots=None, matcher_name='bm',
+                 statistic='mean', percentile=ColumnStatistics.PERCENTILE):
+        self.shape = tuple(shape)
+        self.on_result = on_result
+        if slots is None:
+            slots = workers + 1
+        frame_size = 2 * self.shape[0] * self.shape[1]
+        self.memories = [shared_memory.SharedMemory(create=True, size=frame_size) for i in range(slots)]
+        self.slots = [np.ndarray((2,) + self.shape, np.uint8, buffer=memory.buf) for memory in self.memories]
+        self.free_slots = list(range(slots))
+        self.lock = Condition()
+        self.tasks = mp.Queue()
+        self.results = mp.Queue()
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.compute_time = 0.
+        # first error of workers (or of on_result), raised by check_error() and acquire_slot()
+        self.error = None
+        self.running = True
+        self.workers = [mp.Process(target=disparity_worker,
+                                   args=([memory.name for memory in self.memories], self.shape, settings_name,
+                                         matcher_name, statistic, percentile, self.tasks, self.results),
+                                   daemon=True)
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+        self.collector = Thread(target=collect_results, args=(self,))
+        self.collector.start()
+
+    def acquire_slot(self, wait=False):
+        # returns slot number and its (left, right) arrays to write rectified pair into,
+        # or None when all slots are busy (frame should be dropped), with wait=True it waits for a free slot
+        # (for SLOT_TIMEOUT at most), error of the pool is raised here
+        with self.lock:
+            if wait:
+                if not self.lock.wait_for(lambda: self.free_slots or not self.running or self.error is not None,
+                                          DisparityPool.SLOT_TIMEOUT):
+                    self.fail(RuntimeError('no free disparity slot for {} s'.format(DisparityPool.SLOT_TIMEOUT)))
+            self.check_error()
+            if not self.free_slots:
+                self.dropped += 1
+                return None
+            slot = self.free_slots.pop()
+        return slot, self.slots[slot][0], self.slots[slot][1]
+
+    def submit(self, slot, seq, columns):
+        # columns is the range of valid disparity columns of the rectified strip
+        with self.lock:
+            self.submitted += 1
+        self.tasks.put((slot, seq, columns))
+
+    def release_slot(self, slot, compute_time=None):
+        with self.lock:
+            self.free_slots.append(slot)
+            self.lock.notify()
+            if compute_time is not None:
+                self.completed += 1
+                self.compute_time += compute_time
+
+    def fail(self, error):
+        # the first error is kept, waiting acquire_slot() calls are woken up to raise it
+        with self.lock:
+            if self.error is None:
+                print('Disparity pool failed: {!r}'.format(error))
+                self.error = error
+            self.lock.notify_all()
+
+    def check_error(self):
+        # raises the error of workers in the calling thread (e.g. a pipeline stage)
+        if self.error is not None:
+            raise self.error
+
+    def busy_slots(self):
+        with self.lock:
+            return self.submitted - self.completed
+
+    def get_stats(self):
+        with self.lock:
+            return {'submitted': self.submitted, 'completed': self.completed, 'dropped': self.dropped,
+                    'failed': self.failed, 'mean_time': self.compute_time / self.completed if self.completed else 0.}
+
+    def stop(self):
+        # waits for submitted pairs, stops workers and frees shared memory
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        self.collector.join()
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        del self.slots
+        for memory in self.memories:
+            memory.close()
+            memory.unlink()
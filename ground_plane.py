@@ -0,0 +1,178 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import numpy as np
+
+
+class GroundPlane:
+    # floor plane fitted with RANSAC on a small random sample of reprojected strip pixels, the plane
+    # is cached and refitted only when the share of sample points lying on it drops (REFIT_RATIO of
+    # the share at fitting time), so the usual frame costs one sample check and one compare with
+    # a cached map of floor disparities
+    SAMPLES = 400  # pixels sampled from each frame
+    ITERATIONS = 64  # RANSAC candidate planes (evaluated at once)
+    INLIER_DISTANCE = 0.05  # metres from the plane for a point to be on it
+    MIN_INLIERS = 0.15  # share of sample points on the plane to accept it
+    REFIT_RATIO = 0.7
+    MAX_DISTANCE = 5.  # metres, far points are too noisy for fitting
+    MAX_TILT = 30.  # degrees between plane normal and vertical axis of the camera
+    MIN_HEIGHT = 0.5  # metres of camera above the floor
+    FLOOR_HEIGHT = 0.1  # pixels lower than this above the plane are floor
+    RETRY_FRAMES = 10  # frames between fitting attempts while no floor is found
+
+    def __init__(self, calibration, depth_table, buffers=1, seed=None):
+        # calibration gives centre and focal length of full resolution rectified images,
+        # outputs are used in turn like Rectifier buffers
+        q = np.asarray(calibration['dispartityToDepthMap'], np.float64)
+        self.centre_x = -q[0][3]
+        self.centre_y = -q[1][3]
+        self.focal_length = q[2][3]
+        self.depth_table = depth_table
+        self.random = np.random.default_rng(seed)
+        self.plane = None
+        self.inlier_share = 0.
+        self.retry = 0
+        self.thresholds = None
+        self.geometry = None
+        self.buffers = buffers
+        self.outputs = None
+        self.output_index = 0
+        self.fits = 0
+        self.frames = 0
+
+    def setup(self, shape, columns, strip_left, strip_top):
+        # image coordinates of strip pixels, relative to optical centre in focal lengths
+        self.geometry = (shape, columns, strip_left, strip_top)
+        rows = (np.arange(shape[0]) + strip_top - self.centre_y) / self.focal_length
+        cols = (np.arange(columns[0], columns[1]) + strip_left - self.centre_x) / self.focal_length
+        self.rays_y, self.rays_x = rows, cols
+        self.outputs = [np.empty(shape, np.int16) for i in range(self.buffers)]
+        self.thresholds = None
+        if self.plane is not None:
+            self.build_thresholds()
+
+    def sample_points(self, disparity, columns):
+        # 3d points (metres) of random strip pixels with valid disparity
+        height = disparity.shape[0]
+        rows = self.random.integers(0, height, GroundPlane.SAMPLES)
+        cols = self.random.integers(0, columns[1] - columns[0], GroundPlane.SAMPLES)
+        depth = self.depth_table.lookup(disparity[rows, cols + columns[0]])
+        valid = depth < GroundPlane.MAX_DISTANCE
+        depth = depth[valid].astype(np.float64)
+        return np.stack((self.rays_x[cols[valid]] * depth, self.rays_y[rows[valid]] * depth, depth), axis=1)
+
+    def fit(self, points):
+        # RANSAC over candidate planes of random point triples, the best one is refined with
+        # least squares over its inliers, returns (normal, offset) with camera on the positive side
+        if len(points) < GroundPlane.SAMPLES * GroundPlane.MIN_INLIERS:
+            return None
+        triples = points[self.random.integers(0, len(points), (GroundPlane.ITERATIONS, 3))]
+        normals = np.cross(triples[:, 1] - triples[:, 0], triples[:, 2] - triples[:, 0])
+        lengths = np.linalg.norm(normals, axis=1)
+        normals = normals / np.maximum(lengths, 1e-9)[:, None]
+        offsets = -np.einsum('ij,ij->i', normals, triples[:, 0])
+        # floor is below the camera and nearly perpendicular to its vertical (y) axis
+        possible = (lengths > 1e-9) & (np.abs(normals[:, 1]) > np.cos(np.radians(GroundPlane.MAX_TILT))) & \
+                   (np.abs(offsets) > GroundPlane.MIN_HEIGHT) & (normals[:, 1] * offsets < 0)
+        if not possible.any():
+            return None
+        inliers = np.abs(points @ normals[possible].T + offsets[possible]) < GroundPlane.INLIER_DISTANCE
+        counts = inliers.sum(axis=0)
+        best = np.argmax(counts)
+        if counts[best] < len(points) * GroundPlane.MIN_INLIERS:
+            return None
+        on_plane = points[inliers[:, best]]
+        centre = on_plane.mean(axis=0)
+        normal = np.linalg.svd(on_plane - centre, full_matrices=False)[2][2]
+        offset = -normal @ centre
+        if offset < 0:
+            normal, offset = -normal, -offset
+        return normal, offset
+
+    def distances(self, points):
+        # signed heights of points above the plane (camera side is positive)
+        normal, offset = self.plane
+        return points @ normal + offset
+
+    def update(self, disparity, columns):
+        # checks cached plane on a new sample and refits it when it doesn't fit the floor any more
+        if self.plane is None and self.retry > 0:
+            self.retry -= 1
+            return
+        points = self.sample_points(disparity, columns)
+        if self.plane is not None and len(points) > 0:
+            share = (np.abs(self.distances(points)) < GroundPlane.INLIER_DISTANCE).mean()
+            if share >= self.inlier_share * GroundPlane.REFIT_RATIO:
+                return
+        plane = self.fit(points)
+        self.fits += 1
+        if plane is None:
+            # nothing like a floor is seen, pixels aren't masked
+            self.plane = None
+            self.thresholds = None
+            self.retry = GroundPlane.RETRY_FRAMES
+            return
+        self.plane = plane
+        self.inlier_share = (np.abs(self.distances(points)) < GroundPlane.INLIER_DISTANCE).mean()
+        self.build_thresholds()
+
+    def build_thresholds(self):
+        # largest floor disparity (1/16 px) of each strip pixel: ray of the pixel is
+        # t * (x, y, 1), its height above the plane is t * (normal . ray) + offset, so the pixel
+        # is floor when its depth is beyond (offset - FLOOR_HEIGHT) / -(normal . ray)
+        normal, offset = self.plane
+        slopes = self.rays_y[:, None] * normal[1] + self.rays_x[None, :] * normal[0] + normal[2]
+        reach = offset - GroundPlane.FLOOR_HEIGHT
+        with np.errstate(divide='ignore'):
+            depth = np.where(slopes < 0, reach / -slopes, np.inf)
+        thresholds = np.full(depth.shape, np.iinfo(np.int16).min, np.float64)
+        finite = np.isfinite(depth) & (depth > 0)
+        thresholds[finite] = self.depth_table.disparity_at(depth[finite])
+        # rays going down from under the floor height (reach < 0) are all floor
+        thresholds[(slopes < 0) & (reach <= 0)] = np.iinfo(np.int16).max
+        self.thresholds = np.clip(np.floor(thresholds), np.iinfo(np.int16).min,
+                                  np.iinfo(np.int16).max).astype(np.int16)
+
+    def mask(self, disparity, columns, strip_left=0, strip_top=0):
+        # copy of disparity with floor pixels set invalid (0) in columns range of the strip,
+        # strip_left and strip_top are the strip offsets in full resolution images
+        if self.geometry != (disparity.shape, columns, strip_left, strip_top):
+            self.setup(disparity.shape, columns, strip_left, strip_top)
+        self.frames += 1
+        self.update(disparity, columns)
+        self.output_index = (self.output_index + 1) % self.buffers
+        output = self.outputs[self.output_index]
+        np.copyto(output, disparity)
+        if self.thresholds is not None:
+            valid = output[:, columns[0]:columns[1]]
+            np.putmask(valid, valid <= self.thresholds, 0)
+        return output
+
+    def get_stats(self):
+        stats = {'frames': self.frames, 'fits': self.fits, 'plane': None}
+        if self.plane is not None:
+            normal, offset = self.plane
+            stats['plane'] = [round(float(v), 3) for v in normal] + [round(float(offset), 3)]
+        return stats
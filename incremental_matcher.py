@@ -0,0 +1,161 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import cv2
+import numpy as np
+from threading import Lock
+from matchers import read_map_settings, without_speckles, filter_speckles
+
+
+class IncrementalMatcher:
+    # change detection in front of a matcher: rectified strips are compared with the previous ones
+    # block by block, disparity is recomputed only for columns affected by changed blocks and taken
+    # from cache elsewhere (every column is recomputed at least once in MAX_AGE frames);
+    # recomputed columns are the same as from matching the whole strip for block matching, as base matcher
+    # runs with speckle filter off and the stitched map is filtered once (speckles are connected regions
+    # of any size, so filtering every range apart gives other results); semi-global matching aggregates
+    # costs along whole rows, so it's an approximation there
+    BLOCK_SIZE = 16  # size of compared blocks in pixels
+    CHANGE_THRESHOLD = 6  # mean absolute difference of block (in gray levels) counted as change
+    MAX_AGE = 10  # frames
+    FULL_RATIO = 0.6  # whole strip is matched when more columns have to be recomputed
+    COLUMN_MARGIN = 16  # columns added to matcher input on each side of recomputed range
+
+    def __init__(self, base, fName=None):
+        self.base = base
+        self.min_disparity = base.min_disparity
+        self.num_disparities = base.num_disparities
+        self.block_size = base.block_size
+        self.previous = None
+        # cached map before speckle filter and the filtered one given to caller
+        self.raw = None
+        self.disparity = None
+        self.ages = None
+        self.settings = None
+        self.lock = Lock()
+        self.frames = 0
+        self.full_frames = 0
+        self.recomputed_columns = 0
+        self.total_columns = 0
+        if fName is not None:
+            self.load_settings(fName)
+
+    def configure(self, data):
+        self.base.configure(without_speckles(data))
+        self.settings = data
+        self.min_disparity = self.base.min_disparity
+        self.num_disparities = self.base.num_disparities
+        self.block_size = self.base.block_size
+        # cached disparity was computed with other settings
+        self.previous = None
+
+    def load_settings(self, fName):
+        self.configure(read_map_settings(fName))
+
+    def changed_blocks(self, image, previous):
+        # True for column blocks having at least one changed block
+        diff = cv2.absdiff(image, previous)
+        height, width = diff.shape
+        block = IncrementalMatcher.BLOCK_SIZE
+        blocks = cv2.resize(diff, ((width + block - 1) // block, (height + block - 1) // block),
+                            interpolation=cv2.INTER_AREA)
+        return (blocks > IncrementalMatcher.CHANGE_THRESHOLD).any(axis=0)
+
+    def affected_columns(self, width, left_blocks, right_blocks):
+        # disparity of column x depends on left columns around x and right columns from
+        # x - (min disparity + num disparities) to x - min disparity
+        block = IncrementalMatcher.BLOCK_SIZE
+        margin = IncrementalMatcher.COLUMN_MARGIN
+        min_disparity = self.min_disparity
+        max_disparity = min_disparity + self.num_disparities
+        affected = np.zeros(width + 1, np.int32)
+        for i in np.flatnonzero(left_blocks):
+            affected[max(0, i * block - margin)] += 1
+            affected[min(width, (i + 1) * block + margin)] -= 1
+        for i in np.flatnonzero(right_blocks):
+            affected[max(0, i * block + min_disparity - margin)] += 1
+            affected[max(0, min(width, (i + 1) * block + max_disparity + margin))] -= 1
+        return np.cumsum(affected[:width]) > 0
+
+    def compute(self, left, right):
+        width = left.shape[1]
+        if self.previous is None or self.previous[0].shape != left.shape:
+            recompute = np.ones(width, bool)
+            self.previous = [left.copy(), right.copy()]
+            self.ages = np.zeros(width, np.int32)
+        else:
+            recompute = self.affected_columns(width, self.changed_blocks(left, self.previous[0]),
+                                              self.changed_blocks(right, self.previous[1]))
+            # columns which are not recomputed for too long are refreshed
+            recompute |= self.ages >= IncrementalMatcher.MAX_AGE
+            self.previous[0][:] = left
+            self.previous[1][:] = right
+        count = int(np.count_nonzero(recompute))
+        if count > width * IncrementalMatcher.FULL_RATIO:
+            self.raw = self.base.compute(left, right)
+            count = width
+            self.ages[:] = 0
+        elif count:
+            self.raw = self.raw.copy()
+            self.recompute_ranges(left, right, recompute)
+            self.ages[recompute] = 0
+        if count:
+            self.disparity = self.raw
+            if self.settings is not None:
+                self.disparity = filter_speckles(self.raw.copy(), self.settings)
+        self.ages += 1
+        with self.lock:
+            self.frames += 1
+            self.full_frames += count == width
+            self.recomputed_columns += count
+            self.total_columns += width
+        # cached map is returned as is, so it isn't changed by the next frames
+        return self.disparity
+
+    def recompute_ranges(self, left, right, recompute):
+        # matcher input is wider than recomputed range by disparity search range and block size,
+        # recomputed columns are written into the cached map before speckle filter
+        width = left.shape[1]
+        min_disparity = self.min_disparity
+        margin = IncrementalMatcher.COLUMN_MARGIN
+        extra_left = max(0, min_disparity + self.num_disparities) + margin
+        extra_right = max(0, -min_disparity) + margin
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], recompute.astype(np.int8), [0]))))
+        for x0, x1 in zip(edges[::2], edges[1::2]):
+            input_x0 = max(0, x0 - extra_left)
+            input_x1 = min(width, x1 + extra_right)
+            disparity = self.base.compute(np.ascontiguousarray(left[:, input_x0:input_x1]),
+                                          np.ascontiguousarray(right[:, input_x0:input_x1]))
+            self.raw[:, x0:x1] = disparity[:, x0 - input_x0:x1 - input_x0]
+
+    def get_stats(self):
+        # share of recomputed columns and of frames matched as a whole
+        with self.lock:
+            return {'frames': self.frames,
+                    'recomputed': self.recomputed_columns / self.total_columns if self.total_columns else 0.,
+                    'full': self.full_frames / self.frames if self.frames else 0.}
+
+    def stop(self):
+        self.base.stop()
@@ -0,0 +1,141 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import json
+import cv2
+from threading import Lock
+from time import time, monotonic
+from matchers import make_matcher, read_map_settings, half_settings
+from rectifier import Rectifier
+
+# quality levels from the best to the fastest: resolution of rectified images (480 or 240),
+# share of strip height and numberOfDisparities (None - the value from depth map settings file)
+QUALITY_LEVELS = [
+    {'height': 480, 'strip': 1., 'disparities': None},
+    {'height': 480, 'strip': 0.75, 'disparities': None},
+    {'height': 480, 'strip': 0.75, 'disparities': 80},
+    {'height': 240, 'strip': 1., 'disparities': None},
+    {'height': 240, 'strip': 0.75, 'disparities': 80},
+]
+
+
+class QualityLevel:
+    # rectifier and matcher of one quality level, disparity is always given for full resolution
+    # strip, so column reduction and motor values don't depend on the level
+    def __init__(self, level, calibration, settings_name, strip_name, matcher_name, buffers=1):
+        self.level = level
+        # 240p level uses downscaled maps of the calibration (the same rectified images)
+        self.factor = calibration['leftMapY'].shape[0] // level['height']
+        self.rectifier = Rectifier(calibration, strip_name, buffers, self.factor, level['strip'])
+        data = read_map_settings(settings_name)
+        if level['disparities'] is not None:
+            data['numberOfDisparities'] = level['disparities']
+        self.matcher = make_matcher(matcher_name)
+        self.matcher.configure(half_settings(data) if self.factor == 2 else data)
+        self.rectifier.set_disparity_range(self.matcher.min_disparity, self.matcher.num_disparities,
+                                           self.matcher.block_size)
+
+    def valid_columns(self):
+        # columns with valid disparity in full resolution strip
+        return self.rectifier.valid_columns[0] * self.factor, self.rectifier.valid_columns[1] * self.factor
+
+    def compute(self, rectified_pair):
+        disparity = self.matcher.compute(rectified_pair[0], rectified_pair[1])
+        if self.factor > 1:
+            height, width = disparity.shape
+            disparity = cv2.resize(disparity, (width * self.factor, height * self.factor),
+                                   interpolation=cv2.INTER_NEAREST)
+            disparity = cv2.multiply(disparity, self.factor)
+        return disparity
+
+    def stop(self):
+        self.matcher.stop()
+
+
+class LatencyGovernor:
+    # switches quality levels to keep end-to-end latency under the target: quality is lowered after
+    # DOWN_FRAMES frames over the target and raised after UP_FRAMES frames under UP_RATIO of it,
+    # levels aren't changed for HOLD_TIME after a change (hysteresis against oscillation)
+    SMOOTHING = 0.2  # weight of the newest latency in smoothed value
+    DOWN_FRAMES = 5
+    UP_FRAMES = 30
+    UP_RATIO = 0.6
+    HOLD_TIME = 3.  # seconds
+
+    def __init__(self, target, levels=QUALITY_LEVELS, log_name=None, level=0):
+        # every level change is printed and appended to log file as a json line
+        self.target = target
+        self.levels = levels
+        self.log_name = log_name
+        self.level = level
+        self.lock = Lock()
+        self.latency = None
+        self.over = 0
+        self.under = 0
+        self.changed = monotonic()
+        self.changes = 0
+        self.frames = [0] * len(levels)
+
+    def add_latency(self, latency, stage_times=None):
+        # latency of the frame processed with current level, returns True if the level is changed
+        with self.lock:
+            self.frames[self.level] += 1
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += (latency - self.latency) * LatencyGovernor.SMOOTHING
+            self.over = self.over + 1 if self.latency > self.target else 0
+            self.under = self.under + 1 if self.latency < self.target * LatencyGovernor.UP_RATIO else 0
+            if monotonic() - self.changed < LatencyGovernor.HOLD_TIME:
+                return False
+            if self.over >= LatencyGovernor.DOWN_FRAMES and self.level < len(self.levels) - 1:
+                new_level = self.level + 1
+            elif self.under >= LatencyGovernor.UP_FRAMES and self.level > 0:
+                new_level = self.level - 1
+            else:
+                return False
+            record = {'time': time(), 'from': self.level, 'to': new_level, 'level': self.levels[new_level],
+                      'latency': latency, 'smoothed': self.latency, 'target': self.target,
+                      'stage_times': stage_times}
+            self.level = new_level
+            self.over = 0
+            self.under = 0
+            self.changed = monotonic()
+            self.changes += 1
+        self.log(record)
+        return True
+
+    def log(self, record):
+        print('Quality level {} -> {} {}, latency {:.1f} ms'.format(record['from'], record['to'], record['level'],
+                                                                   record['smoothed'] * 1000))
+        if self.log_name is not None:
+            f = open(self.log_name, 'a')
+            f.write(json.dumps(record) + '\n')
+            f.close()
+
+    def get_stats(self):
+        with self.lock:
+            return {'level': self.level, 'changes': self.changes, 'frames': list(self.frames),
+                    'latency': self.latency}
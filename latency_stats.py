@@ -0,0 +1,129 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import csv
+import json
+import numpy as np
+from threading import Lock
+from time import monotonic
+
+
+class LatencyHistogram:
+    # fixed-size histogram of latencies with log-spaced bins from MIN_LATENCY to MAX_LATENCY
+    # (first and last bins take the values out of the range)
+    BINS = 60
+    MIN_LATENCY = 0.0001  # seconds
+    MAX_LATENCY = 10.
+    EDGES = np.logspace(np.log10(MIN_LATENCY), np.log10(MAX_LATENCY), BINS + 1)
+
+    def __init__(self):
+        self.counts = np.zeros(LatencyHistogram.BINS + 2, np.int64)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, latency):
+        self.counts[np.searchsorted(LatencyHistogram.EDGES, latency, side='right')] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, percent):
+        # upper edge of the bin with the percentile (max for the last bin)
+        if self.count == 0:
+            return None
+        i = int(np.searchsorted(np.cumsum(self.counts), self.count * percent / 100))
+        if i >= LatencyHistogram.BINS + 1:
+            return self.max
+        return min(float(LatencyHistogram.EDGES[i]), self.max)
+
+    def get_stats(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(50), 'p95': self.percentile(95), 'p99': self.percentile(99),
+                'max': self.max}
+
+
+def mark(frame, name, time=None):
+    # end time of a stage for frame dict which started with capture time in frame['marks']
+    frame['marks'].append((name, monotonic() if time is None else time))
+
+
+def timed_stage(name, func):
+    # stage function (of Pipeline) marking its end time in frames it gives
+    def stage(frame):
+        frame = func(frame)
+        if frame is not None:
+            mark(frame, name)
+        return frame
+    return stage
+
+
+class LatencyStats:
+    # latency histograms of stages (time between the previous mark of a frame and the mark of the stage,
+    # so waiting in queues is counted) and of the whole path from capture ('total')
+    def __init__(self):
+        self.histograms = dict()
+        self.lock = Lock()
+
+    def add(self, name, latency):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram()
+            self.histograms[name].add(latency)
+
+    def add_marks(self, marks):
+        # marks are (name, time) from capture to the last stage, returns total latency
+        for (previous, start), (name, end) in zip(marks, marks[1:]):
+            self.add(name, end - start)
+        total = marks[-1][1] - marks[0][1]
+        self.add('total', total)
+        return total
+
+    def get_stats(self):
+        with self.lock:
+            return {name: histogram.get_stats() for name, histogram in self.histograms.items()}
+
+    def print_stats(self):
+        for name, stats in self.get_stats().items():
+            print('{}: mean {:.1f} ms, p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms ({} frames)'.format(
+                name, stats['mean'] * 1000, stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000,
+                stats['max'] * 1000, stats['count']))
+
+    def dump(self, fName):
+        # fName.json with stats and histograms, fName.csv with one row for every bin of every histogram
+        with self.lock:
+            data = {name: dict(histogram.get_stats(), counts=histogram.counts.tolist())
+                    for name, histogram in self.histograms.items()}
+        edges = [0.] + LatencyHistogram.EDGES.tolist() + [float('inf')]
+        f = open(fName + '.json', 'w')
+        json.dump({'bin_edges': edges[1:-1], 'latencies': data}, f, indent=4)
+        f.close()
+        f = open(fName + '.csv', 'w', newline='')
+        writer = csv.writer(f)
+        writer.writerow(['stage', 'bin_from', 'bin_to', 'count'])
+        for name, stats in data.items():
+            for i, count in enumerate(stats['counts']):
+                writer.writerow([name, edges[i], edges[i + 1], count])
+        f.close()
@@ -0,0 +1,302 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import sys
+import json
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+# all matchers take parameters from depth map settings file (3dmap_set.txt) and give
+# int16 disparity in 1/16 px with the size of input images (like StereoBM)
+
+
+def read_map_settings(fName):
+    f = open(fName, 'r')
+    data = json.load(f)
+    f.close()
+    return data
+
+
+def configure_bm(sbm, data):
+    # sbm.setSADWindowSize(SWS)
+    sbm.setPreFilterType(1)
+    sbm.setPreFilterSize(data['preFilterSize'])
+    sbm.setPreFilterCap(data['preFilterCap'])
+    sbm.setMinDisparity(data['minDisparity'])
+    sbm.setNumDisparities(data['numberOfDisparities'])
+    sbm.setTextureThreshold(data['textureThreshold'])
+    sbm.setUniquenessRatio(data['uniquenessRatio'])
+    sbm.setSpeckleRange(data['speckleRange'])
+    sbm.setSpeckleWindowSize(data['speckleWindowSize'])
+
+
+def without_speckles(data):
+    # settings with speckle filter off, for matching parts of a map: speckles are connected regions
+    # of any size, so they are filtered once on the stitched map (see filter_speckles)
+    raw = dict(data)
+    raw['speckleWindowSize'] = 0
+    return raw
+
+
+def filter_speckles(disparity, data):
+    # filter of StereoBM applied in place (speckle range in 1/16 px, filtered speckles are marked
+    # with (minDisparity - 1) in 1/16 px like StereoBM does)
+    if data['speckleRange'] >= 0 and data['speckleWindowSize'] > 0:
+        cv2.filterSpeckles(disparity, (data['minDisparity'] - 1) * 16, data['speckleWindowSize'],
+                           data['speckleRange'])
+    return disparity
+
+
+def half_settings(data):
+    # settings for matching at half resolution: disparities are 2 times smaller
+    half = dict(data)
+    half['minDisparity'] = data['minDisparity'] // 2
+    half['numberOfDisparities'] = max(16, (data['numberOfDisparities'] + 31) // 32 * 16)
+    half['SADWindowSize'] = max(3, data['SADWindowSize'] // 2 | 1)
+    return half
+
+
+class BMMatcher:
+    BLOCK_SIZE = 21
+
+    def __init__(self, fName=None, block_size=BLOCK_SIZE):
+        self.sbm = cv2.StereoBM_create(numDisparities=0, blockSize=block_size)
+        # disparity range and block size (in pixels of input images) define columns which can't be matched
+        self.min_disparity = 0
+        self.num_disparities = 16
+        self.block_size = block_size
+        if fName is not None:
+            self.load_settings(fName)
+
+    def configure(self, data):
+        configure_bm(self.sbm, data)
+        self.min_disparity = data['minDisparity']
+        self.num_disparities = data['numberOfDisparities']
+
+    def load_settings(self, fName):
+        self.configure(read_map_settings(fName))
+
+    def compute(self, left, right):
+        return self.sbm.compute(left, right)
+
+    def stop(self):
+        pass
+
+
+class SGBMMatcher:
+    # semi-global matching, cheaper 3-way mode by default (5-directions mode is SGBM_MODE_SGBM)
+    MODE = cv2.STEREO_SGBM_MODE_SGBM_3WAY
+
+    def __init__(self, fName=None, mode=MODE):
+        self.sgbm = cv2.StereoSGBM_create(minDisparity=0, numDisparities=16, blockSize=5, mode=mode)
+        self.min_disparity = 0
+        self.num_disparities = 16
+        self.block_size = 5
+        if fName is not None:
+            self.load_settings(fName)
+
+    def configure(self, data):
+        block = data['SADWindowSize']
+        self.sgbm.setBlockSize(block)
+        # smoothness penalties recommended by OpenCV for single-channel images
+        self.sgbm.setP1(8 * block * block)
+        self.sgbm.setP2(32 * block * block)
+        self.sgbm.setPreFilterCap(data['preFilterCap'])
+        self.sgbm.setMinDisparity(data['minDisparity'])
+        self.sgbm.setNumDisparities(data['numberOfDisparities'])
+        self.sgbm.setUniquenessRatio(data['uniquenessRatio'])
+        # StereoBM speckle range is in 1/16 px, StereoSGBM one is in pixels
+        self.sgbm.setSpeckleRange(max(1, (data['speckleRange'] + 15) // 16))
+        self.sgbm.setSpeckleWindowSize(data['speckleWindowSize'])
+        self.min_disparity = data['minDisparity']
+        self.num_disparities = data['numberOfDisparities']
+        self.block_size = block
+
+    def load_settings(self, fName):
+        self.configure(read_map_settings(fName))
+
+    def compute(self, left, right):
+        return self.sgbm.compute(left, right)
+
+    def stop(self):
+        pass
+
+
+class HalfResolutionMatcher:
+    # matching downscaled pair and upscaling disparity (about 4 times less work, coarser map)
+    def __init__(self, fName=None, base=None):
+        self.base = base if base is not None else BMMatcher(block_size=BMMatcher.BLOCK_SIZE // 2 | 1)
+        self.min_disparity = 0
+        self.num_disparities = 16
+        self.block_size = self.base.block_size * 2
+        if fName is not None:
+            self.load_settings(fName)
+
+    def configure(self, data):
+        half = half_settings(data)
+        self.base.configure(half)
+        self.min_disparity = half['minDisparity'] * 2
+        self.num_disparities = half['numberOfDisparities'] * 2
+        self.block_size = self.base.block_size * 2
+
+    def load_settings(self, fName):
+        self.configure(read_map_settings(fName))
+
+    def compute(self, left, right):
+        height, width = left.shape[:2]
+        size = (width // 2, height // 2)
+        small_left = cv2.resize(left, size, interpolation=cv2.INTER_AREA)
+        small_right = cv2.resize(right, size, interpolation=cv2.INTER_AREA)
+        disparity = self.base.compute(small_left, small_right)
+        disparity = cv2.resize(disparity, (width, height), interpolation=cv2.INTER_NEAREST)
+        return cv2.multiply(disparity, 2)
+
+    def stop(self):
+        self.base.stop()
+
+
+class TiledMatcher:
+    # StereoBM over horizontal bands matched in parallel threads (one StereoBM for each band)
+    # bands overlap by the block matching window, so the stitched map is bit-identical to
+    # the untiled result; speckles are connected regions of any size, so they are filtered once
+    # on the stitched map
+    BANDS = 4
+
+    def __init__(self, fName=None, bands=BANDS):
+        self.matchers = [BMMatcher() for i in range(bands)]
+        self.executor = ThreadPoolExecutor(max_workers=bands)
+        self.min_disparity = 0
+        self.num_disparities = 16
+        self.block_size = BMMatcher.BLOCK_SIZE
+        if fName is not None:
+            self.load_settings(fName)
+
+    def configure(self, data):
+        for matcher in self.matchers:
+            matcher.configure(without_speckles(data))
+        first = self.matchers[0].sbm
+        self.settings = data
+        # half of the block plus prefilter radius (and a spare row), StereoBM gives identical rows
+        # only when bands start on even rows, so margin and band bounds are even
+        margin = first.getBlockSize() // 2 + max(first.getPreFilterSize() // 2, 1) + 1
+        self.margin = margin + margin % 2
+        self.min_disparity = data['minDisparity']
+        self.num_disparities = data['numberOfDisparities']
+
+    def load_settings(self, fName):
+        self.configure(read_map_settings(fName))
+
+    def band_bounds(self, height):
+        bands = len(self.matchers)
+        return [0] + [(height * i // bands) // 2 * 2 for i in range(1, bands)] + [height]
+
+    def match_band(self, index, left, right, disparity, y0, y1):
+        top = max(0, y0 - self.margin)
+        bottom = min(left.shape[0], y1 + self.margin)
+        band = self.matchers[index].compute(left[top:bottom], right[top:bottom])
+        disparity[y0:y1] = band[y0 - top:y1 - top]
+
+    def compute(self, left, right):
+        bounds = self.band_bounds(left.shape[0])
+        disparity = np.empty(left.shape[:2], np.int16)
+        futures = [self.executor.submit(self.match_band, i, left, right, disparity, bounds[i], bounds[i + 1])
+                   for i in range(len(self.matchers))]
+        for future in futures:
+            future.result()
+        return filter_speckles(disparity, self.settings)
+
+    def stop(self):
+        self.executor.shutdown()
+
+
+# matcher backends by name (for matcherName setting in scripts)
+MATCHERS = {
+    'bm': BMMatcher,
+    'bm_tiled': TiledMatcher,
+    'bm_half': HalfResolutionMatcher,
+    'sgbm_3way': SGBMMatcher,
+    'sgbm': lambda fName=None: SGBMMatcher(fName, cv2.STEREO_SGBM_MODE_SGBM),
+    'sgbm_half': lambda fName=None: HalfResolutionMatcher(fName, SGBMMatcher()),
+}
+
+
+def make_matcher(name, fName=None):
+    if name not in MATCHERS:
+        print('wrong matcher name:', name)
+        raise ValueError
+    return MATCHERS[name](fName)
+
+
+def compare_matchers(left_images, right_images, fName, names=None, repeats=3):
+    # latency and quality of every matcher over rectified pairs
+    # quality is measured against full 8-directions SGBM: share of its valid pixels found by matcher,
+    # mean absolute error and share of pixels with error more than 1 px (where both are valid)
+    reference = SGBMMatcher(fName, cv2.STEREO_SGBM_MODE_HH)
+    references = [reference.compute(l, r) for l, r in zip(left_images, right_images)]
+    results = dict()
+    for name in names or MATCHERS.keys():
+        matcher = make_matcher(name, fName)
+        valid_min = matcher.min_disparity * 16
+        times, found, errors, bad, total = [], 0, 0., 0, 0
+        for left, right, ref in zip(left_images, right_images, references):
+            for i in range(repeats):
+                t1 = monotonic()
+                disparity = matcher.compute(left, right)
+                times.append(monotonic() - t1)
+            ref_valid = ref >= reference.min_disparity * 16
+            both = ref_valid & (disparity >= valid_min)
+            diff = np.abs(disparity[both].astype(np.float32) - ref[both]) / 16
+            total += np.count_nonzero(ref_valid)
+            found += np.count_nonzero(both)
+            errors += diff.sum()
+            bad += np.count_nonzero(diff > 1)
+        matcher.stop()
+        results[name] = {'time': float(np.median(times)), 'density': found / total if total else 0.,
+                         'error': errors / found if found else 0., 'bad': bad / found if found else 0.}
+    return results
+
+
+if __name__ == '__main__':
+    # comparison over stored pairs: python3 matchers.py [folder with pairs] [calibration height]
+    from replay_source import find_stored_pairs
+    from calibration_store import load_calibration
+    from rectifier import Rectifier
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else './demo/'
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 480
+    rectifier = Rectifier(load_calibration('./calibration_data/{}p/stereo_camera_calibration.npz'.format(height)),
+                          'strip_set.txt')
+    left_images, right_images = [], []
+    for left_name, right_name in zip(*find_stored_pairs(folder)):
+        left, right = rectifier.rectify(cv2.imread(left_name, cv2.IMREAD_GRAYSCALE),
+                                        cv2.imread(right_name, cv2.IMREAD_GRAYSCALE))
+        left_images.append(left.copy())
+        right_images.append(right.copy())
+    print('Comparing matchers on', len(left_images), 'pairs from', folder)
+    for name, result in compare_matchers(left_images, right_images, '3dmap_set.txt').items():
+        print('{:10} {:7.1f} ms   density {:5.1%}   error {:5.2f} px   bad {:5.1%}'.format(
+            name, result['time'] * 1000, result['density'], result['error'], result['bad']))
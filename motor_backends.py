@@ -0,0 +1,120 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+from collections import deque
+from time import monotonic
+
+
+class GPIOBackend:
+    # motor pins switched from Python by scheduler of MotorManager (RPi.GPIO is imported here,
+    # so motor_manager.py can be imported without it)
+    generates_waveform = False
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.gpio = GPIO
+        self.pins = []
+
+    def setup(self, pins):
+        self.gpio.cleanup()
+        self.gpio.setmode(self.gpio.BOARD)
+        self.pins = list(pins)
+        for pin in self.pins:
+            self.gpio.setup(pin, self.gpio.OUT)
+            self.gpio.output(pin, self.gpio.LOW)
+
+    def output(self, pin, high):
+        self.gpio.output(pin, self.gpio.HIGH if high else self.gpio.LOW)
+
+    def cleanup(self):
+        self.gpio.cleanup()
+
+
+class PWMBackend(GPIOBackend):
+    # pulses are generated by RPi.GPIO PWM (its own thread in C, not affected by the interpreter):
+    # pulse of on_time every on_time + off_time seconds is frequency and duty cycle of PWM
+    generates_waveform = True
+
+    def setup(self, pins):
+        GPIOBackend.setup(self, pins)
+        self.pwms = dict()
+        self.pulses = dict()
+        for pin in self.pins:
+            self.pwms[pin] = self.gpio.PWM(pin, 1.)
+            self.pwms[pin].start(0)
+            self.pulses[pin] = (0, 0)
+
+    def set_pulses(self, pin, on_time, off_time):
+        # on_time 0 turns motor off
+        if self.pulses[pin] == (on_time, off_time):
+            return
+        self.pulses[pin] = (on_time, off_time)
+        if on_time <= 0:
+            self.pwms[pin].ChangeDutyCycle(0)
+            return
+        self.pwms[pin].ChangeFrequency(1. / (on_time + off_time))
+        self.pwms[pin].ChangeDutyCycle(100. * on_time / (on_time + off_time))
+
+    def cleanup(self):
+        for pwm in self.pwms.values():
+            pwm.stop()
+        GPIOBackend.cleanup(self)
+
+
+class MockBackend:
+    # in-memory motors for running and testing without Raspberry Pi: current levels of pins and
+    # the last EVENTS output changes as (time, pin, high)
+    generates_waveform = False
+    EVENTS = 10000
+
+    def __init__(self):
+        self.levels = dict()
+        self.events = deque(maxlen=MockBackend.EVENTS)
+
+    def setup(self, pins):
+        for pin in pins:
+            self.levels[pin] = False
+
+    def output(self, pin, high):
+        if self.levels[pin] != high:
+            self.events.append((monotonic(), pin, high))
+        self.levels[pin] = high
+
+    def cleanup(self):
+        pass
+
+
+BACKENDS = {
+    'gpio': GPIOBackend,
+    'pwm': PWMBackend,
+    'mock': MockBackend,
+}
+
+
+def make_backend(name):
+    if name not in BACKENDS:
+        print('wrong motor backend:', name)
+        raise ValueError
+    return BACKENDS[name]()
@@ -22,9 +22,11 @@
 # Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
 # for base concepts of stereovision in OpenCV
 
-import RPi.GPIO as GPIO
-from time import sleep
-from threading import Thread
+import heapq
+import numpy as np
+from time import sleep, monotonic
+from threading import Thread, Condition
+from motor_backends import make_backend
 from random import random, choice
 
 MOTOR_PIN_1 = 36
@@ -33,25 +35,56 @@ MOTOR_PIN_3 = 22
 MOTOR_PIN_4 = 26
 PINS = [MOTOR_PIN_1, MOTOR_PIN_2, MOTOR_PIN_3, MOTOR_PIN_4]
 
+# intensity curves: distances to the nearest obstacle (in metres) and pulse timeouts at them,
+# timeouts are interpolated between the points, motor is idle further than the last distance
+CURVES = {
+    'default': ((0.65, 0.85, 1.15, 1.85), (0.02, 0.05, 0.2, 0.7)),
+    'near': ((0.4, 1.2), (0.02, 0.5)),
+    'far': ((0.8, 3.), (0.03, 0.7)),
+}
 
-# turning on motor for constant time but with custom frequency (timeout)
-def operate_motors(motor_id, manager):
-    on = True
-    while manager.running:
-        timeout = manager.current_modes[motor_id]
-        if abs(timeout) < 0.001:
-            GPIO.output(motor_id, GPIO.LOW)
-            sleep(0.5)
-            continue
-        if on:
-            GPIO.output(motor_id, GPIO.LOW)
-            on = False
-            sleep(timeout)
-        else:
-            GPIO.output(motor_id, GPIO.HIGH)
-            on = True
-            sleep(0.01)
-    GPIO.output(motor_id, GPIO.LOW)
+
+class IntensityMapper:
+    # continuous pulse timeouts of all motors from their distances in one call: distances are
+    # smoothed per motor (faster when obstacle gets closer), motor turned on at the last curve
+    # distance is turned off only HYSTERESIS further, and timeout isn't changed by less than DEADBAND
+    ATTACK = 0.7  # weight of the newest distance when it's closer than smoothed one
+    RELEASE = 0.3  # weight of the newest distance when it's further
+    HYSTERESIS = 0.1  # metres
+    DEADBAND = 0.05  # share of current timeout
+
+    def __init__(self, motors, curve='default'):
+        # curve is a name from CURVES or (distances, timeouts)
+        if isinstance(curve, str):
+            if curve not in CURVES:
+                print('wrong intensity curve:', curve)
+                raise ValueError
+            curve = CURVES[curve]
+        self.distances = np.asarray(curve[0], np.float64)
+        self.timeouts = np.asarray(curve[1], np.float64)
+        # distances without obstacles (inf or nan) are smoothed as this one
+        self.far = self.active_distance() + IntensityMapper.HYSTERESIS
+        self.smoothed = np.full(motors, np.nan)
+        self.active = np.zeros(motors, bool)
+        self.output = np.zeros(motors)
+
+    def active_distance(self):
+        # the furthest distance where motors can be on
+        return self.distances[-1] + IntensityMapper.HYSTERESIS
+
+    def map(self, distances):
+        # timeouts for distances of all motors (0 is idle)
+        distances = np.asarray(distances, np.float64)
+        distances = np.minimum(np.nan_to_num(distances, nan=self.far), self.far)
+        weights = np.where(distances < self.smoothed, IntensityMapper.ATTACK, IntensityMapper.RELEASE)
+        self.smoothed = np.where(np.isnan(self.smoothed), distances,
+                                 self.smoothed + weights * (distances - self.smoothed))
+        self.active = np.where(self.active, self.smoothed <= self.active_distance(),
+                               self.smoothed <= self.distances[-1])
+        timeouts = np.interp(self.smoothed, self.distances, self.timeouts)
+        changed = np.abs(timeouts - self.output) > self.output * IntensityMapper.DEADBAND
+        self.output = np.where(self.active, np.where(changed, timeouts, self.output), 0.)
+        return self.output
 
 
 class MotorManager:
@@ -62,17 +95,42 @@ class MotorManager:
     HIGH = 0.05
     CRITICAL = 0.02
 
-    MAX_VALUE = 1600
-    MIN_VALUE = 500
+    # intensity curve for distances (name from CURVES)
+    CURVE = 'default'
+
+    # every motor is turned on for PULSE_TIME and then off for timeout of its mode
+    PULSE_TIME = 0.01
+    MAX_LAG = 0.1  # seconds, late motor is rescheduled from now instead of catching up missed pulses
+    # 'gpio' (pulses switched by scheduler thread), 'pwm' (pulses generated by RPi.GPIO PWM)
+    # or 'mock' (no hardware, see motor_backends.py)
+    BACKEND = 'gpio'
 
-    def __init__(self, *pins):
-        GPIO.cleanup()
-        GPIO.setmode(GPIO.BOARD)
+    def __init__(self, *pins, backend=None, recorder=None, curve=None):
+        # recorder (ActuationRecorder) gets every output edge and mode change
+        self.backend = make_backend(MotorManager.BACKEND if backend is None else backend)
+        self.backend.setup(pins)
+        self.recorder = recorder
+        self.mapper = IntensityMapper(len(pins), MotorManager.CURVE if curve is None else curve)
         self.current_modes = dict()
+        # one scheduler thread for all motors: heap of (deadline, pin, generation) of the next
+        # output edge of every motor, entries of older generations are outdated by mode changes
+        self.condition = Condition()
+        self.deadlines = []
+        self.generations = dict()
+        self.next_edges = dict()
+        self.outputs = dict()
+        self.last_falls = dict()
         for pin in pins:
             self.current_modes[pin] = MotorManager.IDLE
-            GPIO.setup(pin, GPIO.OUT)
+            self.generations[pin] = 0
+            self.next_edges[pin] = None
+            self.outputs[pin] = False
+            self.last_falls[pin] = 0.
         self.running = False
+        self.thread = None
+        self.edges = 0
+        self.max_lateness = 0.
+        self.total_lateness = 0.
 
     def check_motor_id(self, motor_id):
         if motor_id not in self.current_modes.keys():
@@ -84,49 +142,121 @@ class MotorManager:
         return self.current_modes[motor_id]
 
     def set_mode(self, motor_id, timeout):
+        # returns monotonic time of the first pulse in the new mode (None if mode isn't changed or idle)
         self.check_motor_id(motor_id)
-        self.current_modes[motor_id] = timeout
+        with self.condition:
+            if self.current_modes[motor_id] == timeout:
+                return None
+            self.current_modes[motor_id] = timeout
+            if self.recorder is not None:
+                self.recorder.record_mode(motor_id, timeout)
+            now = monotonic()
+            if self.backend.generates_waveform:
+                self.backend.set_pulses(motor_id, 0 if self.is_idle(timeout) else MotorManager.PULSE_TIME, timeout)
+                return None if self.is_idle(timeout) else now
+            # next edge is rescheduled for the new mode right away, current pulse isn't cut
+            # unless motor becomes idle
+            if self.outputs[motor_id]:
+                deadline = now if self.is_idle(timeout) else self.next_edges[motor_id]
+                pulse = None if self.is_idle(timeout) else deadline + timeout
+            elif self.is_idle(timeout):
+                deadline = pulse = None
+            else:
+                deadline = pulse = max(now, self.last_falls[motor_id] + timeout)
+            self.schedule(motor_id, deadline)
+            self.condition.notify()
         # print(f'{motor_id} mode changed to {timeout}')
+        return pulse
+
+    @staticmethod
+    def is_idle(timeout):
+        return abs(timeout) < 0.001
+
+    def schedule(self, motor_id, deadline):
+        # called with condition locked, previous edge of the motor is outdated
+        self.generations[motor_id] += 1
+        self.next_edges[motor_id] = deadline
+        if deadline is not None:
+            heapq.heappush(self.deadlines, (deadline, motor_id, self.generations[motor_id]))
+
+    def switch(self, motor_id, deadline, now):
+        # makes the edge due at deadline and schedules the next one from it
+        timeout = self.current_modes[motor_id]
+        if now - deadline > MotorManager.MAX_LAG:
+            deadline = now
+        if self.outputs[motor_id] or self.is_idle(timeout):
+            self.backend.output(motor_id, False)
+            if self.recorder is not None:
+                self.recorder.record_edge(motor_id, False)
+            self.outputs[motor_id] = False
+            self.last_falls[motor_id] = deadline
+            self.schedule(motor_id, None if self.is_idle(timeout) else deadline + timeout)
+        else:
+            self.backend.output(motor_id, True)
+            if self.recorder is not None:
+                self.recorder.record_edge(motor_id, True)
+            self.outputs[motor_id] = True
+            self.schedule(motor_id, deadline + MotorManager.PULSE_TIME)
+
+    def operate_motors(self):
+        # sleeps until the earliest edge of all motors (or until a mode change)
+        with self.condition:
+            while self.running:
+                if not self.deadlines:
+                    self.condition.wait()
+                    continue
+                deadline, motor_id, generation = self.deadlines[0]
+                if generation != self.generations[motor_id]:
+                    heapq.heappop(self.deadlines)
+                    continue
+                now = monotonic()
+                if deadline > now:
+                    self.condition.wait(deadline - now)
+                    continue
+                heapq.heappop(self.deadlines)
+                self.edges += 1
+                self.total_lateness += now - deadline
+                self.max_lateness = max(self.max_lateness, now - deadline)
+                self.switch(motor_id, deadline, now)
+            for motor_id in self.current_modes.keys():
+                self.backend.output(motor_id, False)
+                self.outputs[motor_id] = False
 
     def start(self):
-        # starting threads for each motor
+        # starting scheduler thread for all motors (not needed when backend generates pulses)
         self.running = True
-        threads = [Thread(target=operate_motors,
-                          args=(pin, self)).start() for pin in self.current_modes.keys()]
-
-    def get_needed_mode(self, value):
-        # calculating motor mode from value
-        if str(value) == 'nan':
-            return MotorManager.IDLE
-        # ratio is calculated as a percentage of all appropriate (min and max) values
-        ratio = (value - MotorManager.MIN_VALUE) / (MotorManager.MAX_VALUE - MotorManager.MIN_VALUE)
-        if ratio < 0:
-            print('wrong min value', value)
-            #raise ValueError
-            return MotorManager.IDLE
-        if ratio > 1:
-            print('wrong max value', value)
-            #raise ValueError
-            return MotorManager.CRITICAL
-
-        print(ratio, end='   ')
-        if ratio <= 0.25:
-            return MotorManager.IDLE
-        elif ratio <= 0.4:
-            return MotorManager.LOW
-        elif ratio <= 0.55:
-            return MotorManager.MEDIUM
-        elif ratio <= 0.7:
-            return MotorManager.HIGH
-        return MotorManager.CRITICAL
+        if self.backend.generates_waveform:
+            return
+        self.thread = Thread(target=self.operate_motors)
+        self.thread.start()
+
+    def get_stats(self):
+        # lateness of output edges (in seconds) shows timing jitter of pulses
+        with self.condition:
+            return {'edges': self.edges, 'max_lateness': self.max_lateness,
+                    'mean_lateness': self.total_lateness / self.edges if self.edges else 0.}
+
+    def set_distances(self, distances):
+        # pulse timeouts of all motors (in order of pins) from distances to the nearest obstacles,
+        # returns time of the earliest pulse in a changed mode (None if no motor got a new active mode)
+        pulses = [self.set_mode(motor_id, float(timeout))
+                  for motor_id, timeout in zip(self.current_modes.keys(), self.mapper.map(distances))]
+        pulses = [pulse for pulse in pulses if pulse is not None]
+        return min(pulses) if pulses else None
 
     def set_all_idle(self):
         for i in self.current_modes.keys():
             self.set_mode(i, MotorManager.IDLE)
 
     def stop(self):
-        self.running = False
-        sleep(1.5)
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        elif self.backend.generates_waveform:
+            for motor_id in self.current_modes.keys():
+                self.backend.set_pulses(motor_id, 0, 0)
 
 
 if __name__ == '__main__':
@@ -161,4 +291,4 @@ if __name__ == '__main__':
         try:
             motor_manager.stop()
         finally:
-            GPIO.cleanup()
+            motor_manager.backend.cleanup()
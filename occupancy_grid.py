@@ -0,0 +1,112 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import numpy as np
+from time import monotonic
+
+SECTORS = 4
+
+
+class OccupancyGrid:
+    # top-down polar grid (range rows x bearing columns) around the camera with evidence of obstacles
+    # fused over time: each frame adds evidence of its valid disparity pixels and older evidence
+    # decays with HALF_LIFE, so static obstacles stay in the grid between frames at low frame rates
+    # while noise seen in a single frame never reaches OCCUPIED
+    MAX_RANGE = 4.  # metres
+    RANGE_BINS = 40
+    FIELD_OF_VIEW = 120.  # degrees, centred on optical axis
+    BEARING_BINS = 40
+    HALF_LIFE = 1.  # seconds
+    GAIN = 0.3  # evidence added by a cell fully covered in one frame
+    MIN_PIXELS = 20  # pixels in a cell for full evidence of one frame (smaller speckles give less)
+    OCCUPIED = 0.5
+
+    def __init__(self, calibration, depth_table):
+        # calibration gives centre and focal length of full resolution rectified images,
+        # depth_table gives distance of every disparity value
+        q = np.asarray(calibration['dispartityToDepthMap'], np.float64)
+        self.centre_x = -q[0][3]
+        self.focal_length = q[2][3]
+        self.depth_table = depth_table
+        self.cells = np.zeros((OccupancyGrid.RANGE_BINS, OccupancyGrid.BEARING_BINS), np.float32)
+        self.hits = np.empty(self.cells.size, np.float32)
+        self.updated = None
+        self.columns = None
+        self.frames = 0
+
+    def setup_columns(self, x0, x1):
+        # bearing bin and slant range factor of every strip column (x in full resolution image)
+        self.columns = (x0, x1)
+        tangents = (np.arange(x0, x1) - self.centre_x) / self.focal_length
+        bearings = np.degrees(np.arctan(tangents))
+        bins = (bearings / OccupancyGrid.FIELD_OF_VIEW + 0.5) * OccupancyGrid.BEARING_BINS
+        self.bearing_bins = np.clip(bins, 0, OccupancyGrid.BEARING_BINS - 1).astype(np.int32)
+        self.range_scale = (np.sqrt(1 + tangents ** 2) * OccupancyGrid.RANGE_BINS
+                            / OccupancyGrid.MAX_RANGE).astype(np.float32)
+        # motor sectors split bearings of the columns with valid disparity (like sector_maxima)
+        edges = np.linspace(0, x1 - x0, SECTORS + 1).astype(np.int64)
+        edges[-1] = x1 - x0 - 1
+        self.sector_bins = [(self.bearing_bins[edges[i]], self.bearing_bins[edges[i + 1]] + (i == SECTORS - 1))
+                            for i in range(SECTORS)]
+
+    def update(self, disparity, columns, strip_left=0, now=None):
+        # adds evidence of valid disparity pixels in columns range of the strip,
+        # strip_left is the first strip column in full resolution image
+        x0, x1 = strip_left + columns[0], strip_left + columns[1]
+        if self.columns != (x0, x1):
+            self.setup_columns(x0, x1)
+        if now is None:
+            now = monotonic()
+        if self.updated is not None:
+            self.cells *= 0.5 ** ((now - self.updated) / OccupancyGrid.HALF_LIFE)
+        self.updated = now
+        # range bin of every pixel, invalid disparities are infinitely far and fall out of the grid
+        ranges = self.depth_table.lookup(disparity[:, columns[0]:columns[1]])
+        ranges *= self.range_scale
+        inside = ranges < OccupancyGrid.RANGE_BINS
+        np.minimum(ranges, OccupancyGrid.RANGE_BINS, out=ranges)
+        cells = ranges.astype(np.int32) * OccupancyGrid.BEARING_BINS + self.bearing_bins
+        counts = np.bincount(cells[inside], minlength=self.cells.size)
+        np.multiply(counts, OccupancyGrid.GAIN / OccupancyGrid.MIN_PIXELS, out=self.hits, casting='unsafe')
+        np.minimum(self.hits, OccupancyGrid.GAIN, out=self.hits)
+        self.cells += self.hits.reshape(self.cells.shape)
+        np.minimum(self.cells, 1, out=self.cells)
+        self.frames += 1
+        return self.cells
+
+    def sector_distances(self):
+        # distance in metres to the nearest occupied cell in each motor sector (inf if it's free)
+        occupied = self.cells >= OccupancyGrid.OCCUPIED
+        distances = []
+        for start, end in self.sector_bins:
+            rows = np.flatnonzero(occupied[:, start:end].any(axis=1))
+            if len(rows) == 0:
+                distances.append(np.inf)
+            else:
+                distances.append(float(rows[0]) * OccupancyGrid.MAX_RANGE / OccupancyGrid.RANGE_BINS)
+        return distances
+
+    def get_stats(self):
+        return {'frames': self.frames, 'occupied': int((self.cells >= OccupancyGrid.OCCUPIED).sum())}
@@ -0,0 +1,248 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+from collections import deque
+from threading import Thread, Condition, Lock
+from time import monotonic
+
+
+class LatestQueue:
+    # bounded queue between stages: when it's full, the oldest item is dropped (latest wins),
+    # or put waits for a free place in blocking mode (every item is processed)
+    def __init__(self, size=1, on_drop=None, blocking=False):
+        self.size = size
+        self.on_drop = on_drop
+        self.blocking = blocking
+        self.items = deque()
+        self.condition = Condition()
+        # finished: no more items will come, closed: pipeline is stopped and items are dropped
+        self.finished = False
+        self.closed = False
+        # statistics: occupancy is sampled at every put
+        self.puts = 0
+        self.dropped = 0
+        self.occupancy_sum = 0
+
+    def put(self, item):
+        dropped = None
+        with self.condition:
+            if self.blocking:
+                self.condition.wait_for(lambda: len(self.items) < self.size or self.closed)
+            if self.closed:
+                dropped = item
+            elif len(self.items) >= self.size:
+                dropped = self.items.popleft()
+                self.dropped += 1
+            if not self.closed:
+                self.items.append(item)
+                self.puts += 1
+                self.occupancy_sum += len(self.items)
+                self.condition.notify()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def get(self, timeout=None):
+        # returns None on timeout or when queue is finished and empty
+        with self.condition:
+            self.condition.wait_for(lambda: self.items or self.finished, timeout)
+            if not self.items:
+                return None
+            # waking up blocked put
+            self.condition.notify_all()
+            return self.items.popleft()
+
+    def finish(self):
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+
+    def close(self):
+        # wakes up waiting stage and returns items left in queue
+        with self.condition:
+            self.finished = True
+            self.closed = True
+            items = list(self.items)
+            self.items.clear()
+            self.condition.notify_all()
+        return items
+
+    def get_stats(self):
+        with self.condition:
+            return {'occupancy': self.occupancy_sum / self.puts if self.puts else 0.,
+                    'size': len(self.items), 'dropped': self.dropped}
+
+
+class Stage:
+    # one step of the pipeline, func gets item of previous stage and returns item for the next one
+    # (None means there is nothing to pass on), source stage func gets no arguments
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.input = None
+        self.output = None
+        self.lock = Lock()
+        self.processed = 0
+        self.busy_time = 0.
+        self.last_time = 0.
+        self.start_time = None
+
+    def account(self, busy_time):
+        with self.lock:
+            self.processed += 1
+            self.busy_time += busy_time
+            self.last_time = busy_time
+
+    def get_stats(self):
+        with self.lock:
+            elapsed = monotonic() - self.start_time if self.start_time is not None else 0.
+            stats = {'processed': self.processed,
+                     'fps': self.processed / elapsed if elapsed > 0 else 0.,
+                     'busy': self.busy_time / elapsed if elapsed > 0 else 0.,
+                     'mean_time': self.busy_time / self.processed if self.processed else 0.}
+        if self.input is not None:
+            stats['queue'] = self.input.get_stats()
+        return stats
+
+
+# func for running one stage in thread
+def run_stage(pipeline, stage):
+    stage.start_time = monotonic()
+    try:
+        while pipeline.running:
+            if stage.input is None:
+                t1 = monotonic()
+                try:
+                    result = stage.func()
+                except StopIteration:
+                    # source is finished, the rest of stages process what is left in queues
+                    break
+            else:
+                item = stage.input.get(timeout=0.1)
+                if item is None:
+                    if stage.input.finished:
+                        break
+                    continue
+                t1 = monotonic()
+                result = stage.func(item)
+            # items which give no result are counted too (e.g. frames sent to worker processes),
+            # source stage calls without result are only waiting for new frames
+            if result is not None or stage.input is not None:
+                stage.account(monotonic() - t1)
+            if result is None:
+                continue
+            if stage.output is not None:
+                stage.output.put(result)
+            else:
+                pipeline.last_result = result
+    except Exception as e:
+        # error in any stage stops the whole pipeline (it's raised again by check_error)
+        print('Pipeline stage {} failed: {!r}'.format(stage.name, e))
+        pipeline.error = e
+        pipeline.close_queues()
+    finally:
+        if stage.output is not None:
+            stage.output.finish()
+        pipeline.stopped(stage)
+
+
+class Pipeline:
+    # stages run in own threads connected with latest-wins queues, so the next frame is rectified
+    # while disparity of the previous one is computed (cv2 releases GIL in heavy functions)
+    # on_drop is called for items dropped from queues (e.g. for releasing camera leases),
+    # with blocking=True nothing is dropped and stages wait for the next ones (for measuring throughput)
+    QUEUE_SIZE = 1
+
+    def __init__(self, stages, queue_size=QUEUE_SIZE, on_drop=None, blocking=False):
+        self.stages = [Stage(name, func) for name, func in stages]
+        self.on_drop = on_drop
+        for previous, stage in zip(self.stages, self.stages[1:]):
+            queue = LatestQueue(queue_size, on_drop, blocking)
+            previous.output = queue
+            stage.input = queue
+        self.last_result = None
+        # the first exception raised by a stage
+        self.error = None
+        self.running = False
+        self.threads = []
+        self.active = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def output_buffers(readers, queue_size=QUEUE_SIZE):
+        # reused output buffers needed by a stage whose results are read by the next readers stages:
+        # one for every place in their queues and for every one of them, the one being written
+        # and the one of the last result (shown by the main thread)
+        return readers * (queue_size + 1) + 2
+
+    def start(self):
+        self.running = True
+        self.active = len(self.stages)
+        self.threads = [Thread(target=run_stage, args=(self, stage)) for stage in self.stages]
+        for thread in self.threads:
+            thread.start()
+
+    def stopped(self, stage):
+        # called by stage thread when it is finished
+        with self.lock:
+            self.active -= 1
+
+    def is_alive(self):
+        with self.lock:
+            return self.active > 0
+
+    def check_error(self):
+        # raises exception of a failed stage in the calling thread
+        if self.error is not None:
+            raise self.error
+
+    def close_queues(self):
+        # stops stages and wakes up the ones waiting in queues (blocking put too), items left are dropped
+        self.running = False
+        for stage in self.stages:
+            if stage.input is not None:
+                for item in stage.input.close():
+                    if self.on_drop is not None:
+                        self.on_drop(item)
+
+    def stop(self):
+        self.close_queues()
+        for thread in self.threads:
+            thread.join()
+
+    def get_stats(self):
+        return {stage.name: stage.get_stats() for stage in self.stages}
+
+    def get_last_times(self):
+        # time of the last item in each stage
+        return {stage.name: stage.last_time for stage in self.stages}
+
+    def print_stats(self):
+        for name, stats in self.get_stats().items():
+            line = '{}: {:.1f} fps, busy {:.0%}, {:.1f} ms per item'.format(
+                name, stats['fps'], stats['busy'], stats['mean_time'] * 1000)
+            if 'queue' in stats:
+                line += ', queue occupancy {:.2f}, dropped {}'.format(stats['queue']['occupancy'],
+                                                                     stats['queue']['dropped'])
+            print(line)
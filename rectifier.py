@@ -0,0 +1,221 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import os
+import json
+import cv2
+import numpy as np
+from time import monotonic
+
+# strip margins in settings file are given in pixels of 480p images and scaled for other calibrations
+REFERENCE_HEIGHT = 480
+
+
+def load_strip_settings(fName):
+    # returns top, bottom, left and right margins cut off from rectified images
+    f = open(fName, 'r')
+    data = json.load(f)
+    f.close()
+    return data['cutTop'], data['cutBottom'], data['cutLeft'], data['cutRight']
+
+
+def downscale_calibration(calibration, factor=2):
+    # rectification maps for frames downscaled by factor (the same rectified images at lower resolution)
+    maps = dict()
+    for name in ('left', 'right'):
+        map_x, map_y = cv2.convertMaps(np.asarray(calibration[name + 'MapX']), np.asarray(calibration[name + 'MapY']),
+                                       cv2.CV_32FC1)
+        height, width = map_x.shape[0] // factor, map_x.shape[1] // factor
+        # mean of factor x factor block is the map value at its centre, coordinates are scaled to small frame
+        map_x = (cv2.resize(map_x, (width, height), interpolation=cv2.INTER_AREA) + 0.5) / factor - 0.5
+        map_y = (cv2.resize(map_y, (width, height), interpolation=cv2.INTER_AREA) + 0.5) / factor - 0.5
+        maps[name + 'MapX'], maps[name + 'MapY'] = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    return maps
+
+
+class Rectifier:
+    # rectification maps cropped to the strip (band of rows and columns) used by the matcher,
+    # so cv2.remap only produces pixels which will be matched
+    CHECK_INTERVAL = 1.  # seconds between checks of strip settings file changes
+    VALID_ROWS_RATIO = 0.5  # share of strip rows with source pixels for a column to be valid
+
+    def __init__(self, calibration, settings_name=None, buffers=1, factor=1, strip_ratio=1.):
+        # calibration is stereo_camera_calibration.npz (or any mapping with the same keys),
+        # with factor > 1 frames are downscaled and rectified at lower resolution,
+        # strip_ratio is the share of strip height (from settings file) kept around its centre
+        self.factor = factor
+        if factor > 1:
+            calibration = downscale_calibration(calibration, factor)
+        self.full_maps = (calibration['leftMapX'], calibration['leftMapY'],
+                          calibration['rightMapX'], calibration['rightMapY'])
+        self.height, self.width = self.full_maps[1].shape[:2]
+        self.small_frames = [None, None]
+        self.strip_ratio = strip_ratio
+        self.margins = (0, 0, 0, 0)
+        # disparity range of the matcher (see set_disparity_range) and strip columns with valid disparity
+        self.disparity_range = None
+        self.valid_columns = (0, self.width)
+        self.band = None
+        self.maps = None
+        # output buffers are used in turn, so with a pipeline next frame doesn't overwrite strips
+        # which are still being matched (one buffer is enough for sequential processing)
+        self.buffers = buffers
+        self.outputs = None
+        self.output_index = 0
+        self.set_margins(0, 0)
+        # strip is taken from settings file and maps are rebuilt when the file is changed
+        self.settings_name = settings_name
+        self.settings_time = None
+        self.last_check = monotonic()
+        if settings_name is not None:
+            self.load_settings()
+
+    def set_band(self, top, bottom, left=0, right=0):
+        # margins are given in pixels of this calibration
+        band = (top, self.height - bottom, left, self.width - right)
+        if band == self.band:
+            return
+        y0, y1, x0, x1 = band
+        if not (0 <= y0 < y1 <= self.height and 0 <= x0 < x1 <= self.width):
+            raise ValueError('wrong strip margins: ' + str((top, bottom, left, right)))
+        self.band = band
+        self.maps = [np.ascontiguousarray(m[y0:y1, x0:x1]) for m in self.full_maps]
+        self.outputs = [[np.empty((y1 - y0, x1 - x0), np.uint8), np.empty((y1 - y0, x1 - x0), np.uint8)]
+                        for i in range(self.buffers)]
+
+    def set_margins(self, top, bottom, left=0, right=0):
+        # band of margins reduced to strip ratio of its height (and to columns which can be matched)
+        self.margins = (top, bottom, left, right)
+        cut = int(round((self.height - top - bottom) * (1 - self.strip_ratio) / 2))
+        top, bottom = top + cut, bottom + cut
+        x0, x1 = left, self.width - right
+        valid = (x0, x1)
+        if self.disparity_range is not None:
+            x0, x1, valid = self.matched_columns(top, self.height - bottom, x0, x1)
+        self.set_band(top, bottom, x0, self.width - x1)
+        self.valid_columns = (valid[0] - x0, valid[1] - x0)
+
+    def source_columns(self, map_x, y0, y1, x0, x1):
+        # range of columns where enough rectified pixels are taken from inside of the source image
+        coords = map_x[y0:y1, x0:x1]
+        inside = (coords[..., 0] >= 0) & (coords[..., 0] < self.width - 1) & \
+                 (coords[..., 1] >= 0) & (coords[..., 1] < self.height - 1)
+        columns = np.flatnonzero(inside.mean(axis=0) >= Rectifier.VALID_ROWS_RATIO)
+        if len(columns) == 0:
+            return x0, x1
+        return x0 + int(columns[0]), x0 + int(columns[-1]) + 1
+
+    def matched_columns(self, y0, y1, x0, x1):
+        # returns columns to be rectified and matched and columns with valid disparity among them:
+        # disparity of column x is searched at left column x and right columns x - max disparity ..
+        # x - min disparity (with half of the block around), so columns near black borders of rectified
+        # images and StereoBM border of disparity search range (at the left and right sides of input)
+        # can't be valid and aren't matched
+        min_disparity, num_disparities, block_size = self.disparity_range
+        max_disparity = min_disparity + num_disparities - 1
+        half_block = block_size // 2
+        left0, left1 = self.source_columns(self.full_maps[0], y0, y1, x0, x1)
+        right0, right1 = self.source_columns(self.full_maps[2], y0, y1, x0, x1)
+        valid0 = max(left0, right0 + max_disparity) + half_block
+        valid1 = min(left1, right1 - min_disparity) - half_block
+        if valid0 >= valid1:
+            # nothing can be matched, strip isn't cut
+            return x0, x1, (x0, x1)
+        input0 = max(x0, valid0 - max(0, max_disparity) - half_block)
+        input1 = min(x1, valid1 + max(-min_disparity, half_block))
+        return input0, input1, (max(valid0, input0), min(valid1, input1))
+
+    def set_disparity_range(self, min_disparity, num_disparities, block_size):
+        # strip is cut to columns where matcher can find disparity (should be set again when
+        # matcher settings are changed, strip settings reloads use the last range)
+        self.disparity_range = (min_disparity, num_disparities, block_size)
+        self.set_margins(*self.margins)
+
+    def strip_left(self):
+        # first strip column in pixels of full resolution rectified images
+        return self.band[2] * self.factor
+
+    def strip_top(self):
+        # first strip row in pixels of full resolution rectified images
+        return self.band[0] * self.factor
+
+    def strip_shape(self):
+        y0, y1, x0, x1 = self.band
+        return y1 - y0, x1 - x0
+
+    def load_settings(self):
+        self.settings_time = os.path.getmtime(self.settings_name)
+        scale = self.height / REFERENCE_HEIGHT
+        margins = [int(round(margin * scale)) for margin in load_strip_settings(self.settings_name)]
+        self.set_margins(*margins)
+        print('Strip settings has been loaded from the file ' + self.settings_name)
+
+    def check_settings(self):
+        now = monotonic()
+        if self.settings_name is None or now - self.last_check < Rectifier.CHECK_INTERVAL:
+            return
+        self.last_check = now
+        try:
+            if os.path.getmtime(self.settings_name) != self.settings_time:
+                self.load_settings()
+        except (OSError, ValueError, KeyError) as e:
+            # keeping previous strip if file is being written or broken
+            print('Strip settings are not reloaded:', e)
+
+    def downscale(self, left, right):
+        # frames are downscaled into reused buffers when rectifying at lower resolution
+        if self.factor == 1:
+            return left, right
+        for i, frame in enumerate((left, right)):
+            self.small_frames[i] = cv2.resize(frame, (self.width, self.height), dst=self.small_frames[i],
+                                              interpolation=cv2.INTER_AREA)
+        return self.small_frames
+
+    def rectify(self, left, right, out=None):
+        # rectified strips are written into reused buffers, they are valid until the next
+        # self.buffers calls (or into out=(left, right) arrays, e.g. shared memory of disparity workers)
+        self.check_settings()
+        left, right = self.downscale(left, right)
+        if out is None:
+            self.output_index = (self.output_index + 1) % self.buffers
+            output = self.outputs[self.output_index]
+        else:
+            output = list(out)
+        output[0] = cv2.remap(left, self.maps[0], self.maps[1], dst=output[0],
+                              interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+        output[1] = cv2.remap(right, self.maps[2], self.maps[3], dst=output[1],
+                              interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+        return output[0], output[1]
+
+    def rectify_columns(self, left, right, x0, x1, maps=None):
+        # rectifies only columns x0:x1 of the strip into new arrays (for matching a part of the strip),
+        # strip settings aren't reloaded here: maps (self.maps taken when the strip was sized) can be given,
+        # so columns are taken from the same strip even if settings are reloaded meanwhile
+        if maps is None:
+            maps = self.maps
+        left, right = self.downscale(left, right)
+        maps = [m[:, x0:x1] for m in maps]
+        return (cv2.remap(left, maps[0], maps[1], interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT),
+                cv2.remap(right, maps[2], maps[3], interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT))
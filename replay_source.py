@@ -0,0 +1,178 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import os
+import re
+import cv2
+from time import sleep, monotonic
+from camera_manager import CameraManager
+
+# names of stored stereo pairs: new_pairs/ and demo/ (left_01.png, right_01.png)
+# and test_pairs/ (01L.png, 01R.png)
+PAIR_NAME_PATTERNS = [(re.compile(r'^left_(.+)\.png$'), re.compile(r'^right_(.+)\.png$')),
+                      (re.compile(r'^(.+)L\.png$'), re.compile(r'^(.+)R\.png$'))]
+
+
+def find_stored_pairs(folder):
+    # returns left and right lists of image paths for complete pairs in folder
+    names = sorted(os.listdir(folder))
+    for left_pattern, right_pattern in PAIR_NAME_PATTERNS:
+        lefts = {m.group(1): name for m, name in ((left_pattern.match(n), n) for n in names) if m}
+        rights = {m.group(1): name for m, name in ((right_pattern.match(n), n) for n in names) if m}
+        keys = sorted(lefts.keys() & rights.keys())
+        if keys:
+            return ([os.path.join(folder, lefts[key]) for key in keys],
+                    [os.path.join(folder, rights[key]) for key in keys])
+    return [], []
+
+
+class ReplayCapture:
+    # replacement for cv2.VideoCapture which serves stored images or a video file
+    # realtime mode paces frames with fps, otherwise frames are given as fast as possible
+    def __init__(self, source, fps=CameraManager.FPS, realtime=True, loop=True, preload=False):
+        self.realtime = realtime
+        self.loop = loop
+        self.video = None
+        self.images = None
+        self.files = None
+        self.preload = preload
+        # stored images are read as grayscale when CAP_PROP_CONVERT_RGB is turned off (like in gray camera mode)
+        self.read_flag = cv2.IMREAD_COLOR
+        if isinstance(source, str):
+            self.video = cv2.VideoCapture(source)
+            video_fps = self.video.get(cv2.CAP_PROP_FPS)
+            if video_fps > 0:
+                fps = video_fps
+        else:
+            self.files = list(source)
+            self.load_images()
+        self.fps = fps
+        self.position = 0
+        self.frame = None
+        self.start_time = None
+        self.opened = self.video.isOpened() if self.video is not None else len(self.files) > 0
+
+    def load_images(self):
+        if self.preload:
+            # decoding everything beforehand, so benchmarks don't measure png decoding
+            self.images = [cv2.imread(name, self.read_flag) for name in self.files]
+
+    def isOpened(self):
+        return self.opened
+
+    def wait_frame_time(self):
+        if self.start_time is None:
+            self.start_time = monotonic()
+        delay = self.start_time + self.position / self.fps - monotonic()
+        if delay > 0:
+            sleep(delay)
+
+    def grab(self):
+        if not self.opened:
+            return False
+        if self.realtime:
+            self.wait_frame_time()
+        if self.video is not None:
+            success = self.video.grab()
+            if not success and self.loop:
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                success = self.video.grab()
+        else:
+            index = self.position % len(self.files) if self.loop else self.position
+            success = index < len(self.files)
+            if success:
+                if self.images is not None:
+                    self.frame = self.images[index]
+                else:
+                    self.frame = cv2.imread(self.files[index], self.read_flag)
+                success = self.frame is not None
+        if not success:
+            self.opened = False
+            return False
+        self.position += 1
+        return True
+
+    def retrieve(self, image=None, flag=0):
+        if self.video is not None:
+            return self.video.retrieve(image, flag)
+        if self.frame is None:
+            return False, None
+        if image is not None and image.shape == self.frame.shape and image.dtype == self.frame.dtype:
+            image[...] = self.frame
+            return True, image
+        return True, self.frame.copy()
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def set(self, prop_id, value):
+        # only colour conversion of stored images can be changed
+        if prop_id == cv2.CAP_PROP_CONVERT_RGB and self.files is not None:
+            self.read_flag = cv2.IMREAD_COLOR if value else cv2.IMREAD_GRAYSCALE
+            self.load_images()
+            return True
+        return False
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop_id == cv2.CAP_PROP_POS_FRAMES:
+            return self.position
+        if prop_id in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+            if self.video is not None:
+                return self.video.get(prop_id)
+            if self.frame is None:
+                return 0
+            return self.frame.shape[1] if prop_id == cv2.CAP_PROP_FRAME_WIDTH else self.frame.shape[0]
+        if prop_id == cv2.CAP_PROP_FRAME_COUNT:
+            if self.video is not None:
+                return self.video.get(cv2.CAP_PROP_FRAME_COUNT)
+            return len(self.files)
+        return 0
+
+    def release(self):
+        self.opened = False
+        if self.video is not None:
+            self.video.release()
+
+
+def open_replay(source, realtime=True, loop=True, preload=None, fps=CameraManager.FPS, **manager_args):
+    # creates CameraManager which serves stored stereo pairs instead of cameras
+    # source is a folder with stored pairs or (left, right) tuple of video files
+    # realtime=False gives pairs as fast as they are consumed (every pair exactly once) for benchmarking
+    if preload is None:
+        preload = not realtime
+    if isinstance(source, str):
+        left_source, right_source = find_stored_pairs(source)
+        if not left_source:
+            raise ValueError('no stereo pairs found in ' + source)
+    else:
+        left_source, right_source = source
+    left_cap = ReplayCapture(left_source, fps, realtime, loop, preload)
+    right_cap = ReplayCapture(right_source, fps, realtime, loop, preload)
+    return CameraManager(synchronized=True, left_cap=left_cap, right_cap=right_cap,
+                         lockstep=not realtime, **manager_args)
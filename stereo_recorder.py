@@ -0,0 +1,144 @@
+# Copyright (C) 2021 Denis Bakin a.k.a. MrEmgin
+#
+# This file is a part of TouchAndGo project for blind people.
+# It was completed as an individual project in the 10th grade
+#
+# TouchAndGo is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# TouchAndGo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TouchAndGo tutorial.
+# If not, see <http://www.gnu.org/licenses/>.
+#
+#          <><><> SPECIAL THANKS: <><><>
+#
+# Thanks for StereoPi tutorial https://github.com/realizator/stereopi-fisheye-robot
+# for base concepts of stereovision in OpenCV
+
+
+import os
+import json
+import cv2
+import numpy as np
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+from time import monotonic
+from camera_manager import StereoPair
+
+INDEX_NAME = 'index.json'
+
+
+# func for writing queued pairs in thread, so capture and display loops are never blocked by disk
+def write_records(recorder):
+    while recorder.running or not recorder.queue.empty():
+        try:
+            record = recorder.queue.get(timeout=0.1)
+        except Empty:
+            continue
+        if recorder.images:
+            recorder.write_images(*record)
+        else:
+            recorder.chunk.append(record)
+            if len(recorder.chunk) >= recorder.chunk_size:
+                recorder.write_chunk()
+    if recorder.chunk:
+        recorder.write_chunk()
+
+
+class StereoRecorder:
+    # records stereo pairs in a background thread
+    # pairs are written into chunks (npz files with frames, timestamps, skews and seqs)
+    # with index.json describing all chunks, or as left_01.png/right_01.png images (images=True)
+    QUEUE_SIZE = 30
+    CHUNK_SIZE = 25
+
+    def __init__(self, path, compressed=False, images=False, chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.compressed = compressed
+        self.images = images
+        self.chunk_size = chunk_size
+        self.queue = Queue(maxsize=queue_size)
+        self.chunk = []
+        self.index = {'chunks': [], 'frames': 0, 'dropped': 0, 'compressed': compressed}
+        self.lock = Lock()
+        self.recorded = 0
+        self.dropped = 0
+        self.running = True
+        self.writer = Thread(target=write_records, args=(self,))
+        self.writer.start()
+
+    def add(self, left, right, timestamp=None, skew=0., seq=0):
+        # non-blocking, pair is dropped (and counted) when disk can't keep up
+        # frames must not be changed after adding (use copies of leased frames)
+        if timestamp is None:
+            timestamp = monotonic()
+        try:
+            self.queue.put_nowait((left, right, timestamp, skew, seq))
+            return True
+        except Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def add_pair(self, pair):
+        return self.add(pair.left, pair.right, pair.timestamp, pair.skew, pair.seq)
+
+    def write_images(self, left, right, timestamp, skew, seq):
+        number = str(self.recorded + 1).zfill(2)
+        if left is not None:
+            cv2.imwrite(os.path.join(self.path, 'left_' + number + '.png'), left)
+        if right is not None:
+            cv2.imwrite(os.path.join(self.path, 'right_' + number + '.png'), right)
+        with self.lock:
+            self.recorded += 1
+
+    def write_chunk(self):
+        lefts, rights, timestamps, skews, seqs = zip(*self.chunk)
+        name = 'chunk_' + str(len(self.index['chunks'])).zfill(5) + '.npz'
+        save = np.savez_compressed if self.compressed else np.savez
+        save(os.path.join(self.path, name), left=np.stack(lefts), right=np.stack(rights),
+             timestamps=np.array(timestamps), skews=np.array(skews), seqs=np.array(seqs))
+        with self.lock:
+            self.recorded += len(self.chunk)
+            dropped = self.dropped
+        self.index['chunks'].append({'file': name, 'frames': len(self.chunk),
+                                     'start': timestamps[0], 'end': timestamps[-1]})
+        self.index['frames'] = self.recorded
+        self.index['dropped'] = dropped
+        self.chunk = []
+        # index is replaced at once, so it is never broken if recording is interrupted
+        index_name = os.path.join(self.path, INDEX_NAME)
+        f = open(index_name + '.tmp', 'w')
+        json.dump(self.index, f, indent=4)
+        f.close()
+        os.replace(index_name + '.tmp', index_name)
+
+    def get_counters(self):
+        with self.lock:
+            return {'recorded': self.recorded, 'dropped': self.dropped, 'queued': self.queue.qsize()}
+
+    def stop(self):
+        # waits until all queued pairs are written
+        self.running = False
+        self.writer.join()
+        print('Recording stopped:', self.get_counters())
+
+
+def read_recording(path):
+    # generator of StereoPair from chunks recorded by StereoRecorder
+    f = open(os.path.join(path, INDEX_NAME), 'r')
+    index = json.load(f)
+    f.close()
+    for chunk in index['chunks']:
+        data = np.load(os.path.join(path, chunk['file']))
+        lefts, rights = data['left'], data['right']
+        for i, (timestamp, skew, seq) in enumerate(zip(data['timestamps'], data['skews'], data['seqs'])):
+            yield StereoPair(lefts[i], rights[i], float(timestamp), float(skew), int(seq))
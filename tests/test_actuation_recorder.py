@@ -0,0 +1,56 @@
+import time
+import numpy as np
+from actuation_recorder import ActuationRecorder, analyze
+from motor_manager import MotorManager, PINS
+
+
+def test_analyze_synthetic_records():
+    recorder = ActuationRecorder(size=64)
+    pin = 7
+    recorder.record_mode(pin, 0.05, time=1.)
+    # pulses of 10 ms every 60 ms, the second one starts 2 ms late and is 1 ms longer
+    for start, width in [(1.001, 0.01), (1.063, 0.011), (1.121, 0.01)]:
+        recorder.record_edge(pin, True, time=start)
+        recorder.record_edge(pin, False, time=start + width)
+    stats = analyze(recorder.snapshot(), pulse_time=0.01)[pin]
+    assert stats['pulses'] == 3
+    assert stats['mode_changes'] == 1
+    # periods 62 and 58 ms against intended 60 ms
+    assert np.isclose(stats['period_error_mean'], 0.)
+    assert np.isclose(stats['jitter']['max'], 0.002)
+    assert np.isclose(stats['width_error']['max'], 0.001)
+    assert np.isclose(stats['mode_latency']['max'], 0.001)
+
+
+def test_ring_buffer_keeps_the_newest_records():
+    recorder = ActuationRecorder(size=4)
+    for i in range(6):
+        recorder.record_edge(1, i % 2 == 0, time=float(i))
+    assert list(recorder.snapshot()['times']) == [2., 3., 4., 5.]
+
+
+def test_mock_motors_pulse_in_mode_periods():
+    recorder = ActuationRecorder()
+    manager = MotorManager(*PINS, backend='mock', recorder=recorder)
+    manager.start()
+    try:
+        manager.set_mode(PINS[0], MotorManager.CRITICAL)
+        manager.set_mode(PINS[1], MotorManager.HIGH)
+        time.sleep(0.4)
+        manager.set_mode(PINS[0], MotorManager.HIGH)
+        time.sleep(0.3)
+    finally:
+        manager.set_all_idle()
+        manager.stop()
+    assert not any(manager.backend.levels.values())
+    report = analyze(recorder.snapshot(), MotorManager.PULSE_TIME)
+    for pin in PINS[:2]:
+        stats = report[pin]
+        assert stats['pulses'] >= 5
+        # scheduler keeps periods of modes on average, single edges may be late on a busy machine
+        assert abs(stats['period_error_mean']) < 0.005
+        assert stats['jitter']['p50'] < 0.005
+        assert stats['width_error']['p50'] < 0.005
+        # the first mode change comes from idle, so its first pulse starts right away
+        assert stats['mode_latency']['p50'] < MotorManager.HIGH + MotorManager.PULSE_TIME
+    assert PINS[2] not in report
@@ -0,0 +1,31 @@
+import numpy as np
+from calibration_store import load_calibration
+from depth_table import DepthTable
+
+
+def save_calibration(path):
+    q = np.array([[1., 0., 0., -320.], [0., 1., 0., -240.], [0., 0., 0., 250.], [0., 0., 0.2, -6.]])
+    np.savez_compressed(path, dispartityToDepthMap=q, depthUnit=np.float64(0.025),
+                        leftMapX=np.arange(12, dtype=np.int16).reshape(3, 4))
+
+
+def test_scalar_keeps_shape(tmp_path):
+    name = str(tmp_path / 'stereo_camera_calibration.npz')
+    save_calibration(name)
+    # the first load builds the cache, the second one opens it
+    for i in range(2):
+        calibration = load_calibration(name)
+        assert calibration['depthUnit'].shape == ()
+        assert calibration['depthUnit'].item() == 0.025
+        assert calibration['leftMapX'].shape == (3, 4)
+        assert np.array_equal(calibration['leftMapX'], np.arange(12).reshape(3, 4))
+    assert (tmp_path / 'stereo_camera_calibration.cache').is_file()
+
+
+def test_depth_table_uses_saved_unit(tmp_path):
+    name = str(tmp_path / 'stereo_camera_calibration.npz')
+    save_calibration(name)
+    table = DepthTable(load_calibration(name))
+    assert table.unit == 0.025
+    # depth = Q[2][3] / (Q[3][2] * d + Q[3][3]) in units of calibration
+    assert np.isclose(table.distances([80 * 16])[0], 250 / (0.2 * 80 - 6) * 0.025, rtol=1e-6)
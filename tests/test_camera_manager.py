@@ -0,0 +1,25 @@
+import os
+import time
+from replay_source import open_replay
+
+DEMO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo')
+
+
+def test_listener_gets_every_captured_pair():
+    man = open_replay(DEMO, realtime=True, fps=50)
+    pairs = []
+    try:
+        man.add_listener(pairs.append)
+        time.sleep(0.3)
+        man.remove_listener(pairs.append)
+        count = len(pairs)
+        time.sleep(0.1)
+    finally:
+        man.stop()
+    assert count == len(pairs) > 5
+    seqs = [pair.seq for pair in pairs]
+    assert seqs == list(range(seqs[0], seqs[0] + len(seqs)))
+    # pooled frames are copied, so they aren't overwritten by capture
+    assert len({id(pair.left) for pair in pairs}) == len(pairs)
+    # listeners are not consumers
+    assert man.get_counters()['consumed'] == 0
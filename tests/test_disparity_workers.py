@@ -0,0 +1,52 @@
+import os
+import time
+import numpy as np
+import pytest
+from disparity_workers import DisparityPool
+
+SETTINGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '3dmap_set.txt')
+SHAPE = (40, 160)
+
+
+def test_pool_computes_sectors():
+    results = []
+    pool = DisparityPool(SHAPE, SETTINGS, on_result=lambda seq, sectors: results.append(seq), workers=1)
+    try:
+        slot, left, right = pool.acquire_slot(wait=True)
+        left[:] = np.random.randint(0, 255, SHAPE)
+        right[:] = left
+        pool.submit(slot, 7, (0, SHAPE[1]))
+    finally:
+        pool.stop()
+    assert results == [7]
+    assert pool.get_stats()['completed'] == 1
+
+
+def test_failed_frame_frees_slot_and_is_raised():
+    results = []
+    pool = DisparityPool(SHAPE, SETTINGS, on_result=lambda seq, sectors: results.append(seq), workers=1, slots=1)
+    try:
+        slot, left, right = pool.acquire_slot()
+        # broken column range fails in the worker
+        pool.submit(slot, 1, (None, 'x'))
+        with pytest.raises(RuntimeError):
+            pool.acquire_slot(wait=True)
+    finally:
+        pool.stop()
+    assert results == []
+    assert pool.free_slots == [slot]
+    assert pool.get_stats()['failed'] == 1
+
+
+def test_dead_worker_wakes_up_waiting_slot():
+    # worker can't load matcher settings and exits, its slot would never be given back
+    pool = DisparityPool(SHAPE, 'missing_settings.txt', workers=1, slots=1)
+    try:
+        slot = pool.acquire_slot()
+        pool.submit(slot[0], 1, (0, SHAPE[1]))
+        start = time.monotonic()
+        with pytest.raises(RuntimeError):
+            pool.acquire_slot(wait=True)
+        assert time.monotonic() - start < DisparityPool.SLOT_TIMEOUT
+    finally:
+        pool.stop()
@@ -0,0 +1,24 @@
+import os
+import cv2
+from matchers import BMMatcher, read_map_settings
+from incremental_matcher import IncrementalMatcher
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_recomputed_columns_match_whole_strip():
+    data = read_map_settings(os.path.join(ROOT, '3dmap_set.txt'))
+    whole = BMMatcher()
+    whole.configure(data)
+    for i in range(1, 6):
+        left = cv2.imread(os.path.join(ROOT, 'demo', 'left_0{}.png'.format(i)), cv2.IMREAD_GRAYSCALE)
+        right = cv2.imread(os.path.join(ROOT, 'demo', 'right_0{}.png'.format(i)), cv2.IMREAD_GRAYSCALE)
+        matcher = IncrementalMatcher(BMMatcher())
+        matcher.configure(data)
+        matcher.compute(left, right)
+        # a few column blocks look changed, so only their columns are matched again
+        for x in (40, 200, 330):
+            matcher.previous[0][:, x:x + 40] = 0
+        disparity = matcher.compute(left, right)
+        assert matcher.get_stats()['full'] == 0.5
+        assert (disparity == whole.compute(left, right)).all()
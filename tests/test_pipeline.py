@@ -0,0 +1,72 @@
+import time
+import pytest
+from pipeline import Pipeline
+
+
+def wait_stopped(pipeline, timeout=3.):
+    end = time.monotonic() + timeout
+    while pipeline.is_alive() and time.monotonic() < end:
+        time.sleep(0.01)
+    return not pipeline.is_alive()
+
+
+def test_failed_stage_stops_pipeline():
+    def source():
+        time.sleep(0.01)
+        return 1
+
+    def fail(item):
+        raise RuntimeError('broken stage')
+
+    pipeline = Pipeline([('source', source), ('fail', fail), ('sink', lambda item: item)])
+    pipeline.start()
+    try:
+        assert wait_stopped(pipeline)
+        with pytest.raises(RuntimeError):
+            pipeline.check_error()
+    finally:
+        pipeline.stop()
+
+
+def test_blocking_pipeline_keeps_every_item():
+    items = iter(range(20))
+    results = []
+
+    def source():
+        return next(items)
+
+    def slow(item):
+        time.sleep(0.005)
+        return item
+
+    def sink(item):
+        results.append(item)
+        return item
+
+    pipeline = Pipeline([('source', source), ('slow', slow), ('sink', sink)], blocking=True)
+    pipeline.start()
+    try:
+        assert wait_stopped(pipeline)
+    finally:
+        pipeline.stop()
+    assert results == list(range(20))
+
+
+def test_failed_stage_stops_blocking_pipeline():
+    def source():
+        return 1
+
+    def fail(item):
+        time.sleep(0.05)
+        raise RuntimeError('broken stage')
+
+    # source and pass-through stage wait in blocking put when the failing stage stops taking items
+    pipeline = Pipeline([('source', source), ('pass', lambda item: item), ('fail', fail),
+                         ('sink', lambda item: item)], blocking=True)
+    pipeline.start()
+    try:
+        assert wait_stopped(pipeline)
+        with pytest.raises(RuntimeError):
+            pipeline.check_error()
+    finally:
+        pipeline.stop()